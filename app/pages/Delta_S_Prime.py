@@ -1,13 +1,22 @@
-from pathlib import Path
 import numpy as np
 import pandas as pd
-from scipy.stats import mannwhitneyu
 
 import plotly.graph_objects as go
 import plotly.express as px
 from plotly.subplots import make_subplots
 import streamlit as st
 
+from services import depmap
+from services.group_stats import (
+    MODIFIED_Z_OUTLIER,
+    benjamini_hochberg,
+    grouped_mannwhitneyu,
+    grouped_modified_z_scores,
+    grouped_robust_stats,
+)
+from services.ontology import load_ontology
+from views.exports import download_section
+
 # Remove authentication - no longer needed
 # from views.signed_in_landing import landing_page
 
@@ -33,33 +42,21 @@ with st.sidebar:
     st.write("Navigate between different analysis tools using the links above.")
 
 
-def fetch_df(file, **kwargs):
-    data_path = Path(file)
-    return pd.read_csv(data_path, **kwargs)
-
-
-def build_df(*args, **kwargs):
-    # Load the data
-    # extracting only columns: 'name', 'moa', 'target', 'lower_limit', 'upper_limit', 'ec50'
-    column_order = ['name', 'moa', 'target', 'lower_limit', 'upper_limit', 'ec50', 'auc', 'ccle_name', 'row_name', 'screen_id']
-    df = fetch_df(*args, **kwargs)
-    df = df[column_order]
-
-    # Derive EFF (upper_limit - lower_limit) 
-    df['EFF'] = df['upper_limit'] - df['lower_limit']
+@st.cache_resource(show_spinner="Loading PRISM dose response parameters...", max_entries=1)
+def load_prism(file, fingerprint):
+    """PRISM table with EFF, S' and tissue derived once, shared read-only by all sessions
 
-    # Derive EFF*100
-    df['EFF*100'] = df['EFF'] * 100
+    ``fingerprint`` is only part of the cache key so that a changed file is reloaded.
+    """
+    return depmap.load_prism_table(file)
 
-    # Derive EFF/EC50
-    df['EFF/EC50'] = df['EFF'] / df['ec50']
 
-    # Derive S'
-    # ASINH((EFF*100)/EC50)
-    df["S'"] = np.arcsinh(df['EFF*100'] / df['ec50'])
-    return df
+def build_df(file, fingerprint):
+    return load_prism(str(file), fingerprint)
 
-df = build_df("data/DepMap/Prism19Q4/secondary-screen-dose-response-curve-parameters.csv", usecols=['name', 'moa', 'target', 'lower_limit', 'upper_limit', 'auc', 'ec50', 'ccle_name', 'row_name', 'screen_id'])
+# cheap (stat only) key of the table contents, for the caches and the downloads
+prism_key = tuple(depmap.prism_fingerprint(depmap.PRISM_FILE).items())
+df = build_df(depmap.PRISM_FILE, prism_key)
 
 # Future: use same calculations as data.py
 # df_ranked = compute_ranked_delta_s_prime(df)
@@ -74,12 +71,7 @@ st.dataframe(get_single_testvalue())
 "## S' Table"
 # Display the table
 st.dataframe(df)
-st.download_button(
-                label="Download data as CSV",
-                data=df.to_csv().encode('utf-8'),
-                file_name='delta_s_prime.csv',
-                mime='text/csv'
-            )
+download_section(df, file_name='delta_s_prime.csv', key='download-s-prime-table', cache_key=prism_key)
 
 # Add a filter (dropdown on the column 'name') that updates a dataframe table view.
 
@@ -87,19 +79,26 @@ st.header("Damaging Mutations")
 
 studies = st.multiselect(label='Choose studies included', options=['HTS002', 'MTS005', 'MTS006', 'MTS010',  'HTSwithMTS010_Overlayed'], default=['HTSwithMTS010_Overlayed'])
 
-def modify_df(df):
-    df[['ccle', 'tissue']] = df['ccle_name'].str.split('_', n=1, expand=True)
-    return df
-df = modify_df(df)
+# ccle and tissue (split from ccle_name) are part of the cached table
 
 active_gene = 'NF1 (4763)'
 tissue = 'LUNG'
 
-damaging_mutations = fetch_df('data/DepMap/Public24Q2/OmicsSomaticMutationsMatrixDamaging.csv')
+@st.cache_resource(show_spinner="Loading damaging mutations...", max_entries=1)
+def load_damaging_mutations(file, fingerprint):
+    """Gene-indexed store of the mutations matrix, one gene column is read per query
+
+    ``fingerprint`` is only part of the cache key so that a changed file is reloaded.
+    """
+    return depmap.load_mutation_store(file)
+
+
+mutations_key = tuple(depmap.mutations_fingerprint(depmap.MUTATIONS_FILE).items())
+damaging_mutations = load_damaging_mutations(str(depmap.MUTATIONS_FILE), mutations_key)
 
 
 #drop down menu to choose from different genes (columns of damaging mutations)
-active_gene = st.selectbox(label="Active Gene", placeholder="e.g. NF1", index=damaging_mutations.columns.tolist()[1:].index(active_gene), options=damaging_mutations.columns.tolist()[1:]);
+active_gene = st.selectbox(label="Active Gene", placeholder="e.g. NF1", index=damaging_mutations.gene_index[active_gene], options=damaging_mutations.genes);
 
 #drop down menu to choose form different tissue (based on depmap data) (sorted alphabetically) (autocomplete search)
 tissue = st.selectbox(label= "Tissue", placeholder="e.g. Pancreas", index=None, options = df['tissue'].unique())   
@@ -108,10 +107,13 @@ st.header("All S' by Mutation and Tissue")
 
 def filter_df(active_gene, tissue):
     #Unnamed: 0 is the tissue column name in damaging_mutations file
-    filtered_gene_values = damaging_mutations[damaging_mutations[active_gene].isin([0, 2])][['Unnamed: 0', active_gene]]
+    gene_values = damaging_mutations.gene_frame(active_gene)
+    filtered_gene_values = gene_values[gene_values[active_gene].isin([0, 2])]
 
     dm_merged = pd.merge(df, filtered_gene_values, left_on='row_name', right_on='Unnamed: 0', how='inner')
     dm_merged = dm_merged.loc[dm_merged['screen_id'].isin(studies) & (dm_merged['tissue'] == tissue)].drop(columns=['Unnamed: 0', 'ccle_name'])
+    # the selected rows are few, plain object columns keep groupby and apply simple
+    dm_merged = dm_merged.astype({col: object for col in dm_merged.select_dtypes('category').columns})
 
     def format_target(row):
         if isinstance(row, str):  
@@ -122,47 +124,14 @@ def filter_df(active_gene, tissue):
     dm_merged['target'] = dm_merged['target'].apply(format_target)
 
     ########################################################################
-    target = fetch_df('Manual_ontology.csv')
-    df_reference_ontolgy = pd.DataFrame ( columns = ["Group", "Sub", "Gene"])
-    Group = None
-    for i in range(len(target)):
-        Current_group = str(target.loc[i,'Group']).strip()
-        if Current_group != "nan": 
-            Group = Current_group 
-        df_reference_ontolgy.loc[i] = [Group, target.loc[i,'Sub'], target.loc[i,'Gene']]
-
-    rows_to_append = []
-    genes_not_in_manual_ontology = []
-    # Add a new column to dm_merged to hold the group and sub strings
-    dm_merged['group_sub'] = ''
-
-    # Iterate through dm_merged and update rows_to_append and dm_merged
-    for i, row in dm_merged.iterrows():
-        group_sub_list = []  # Temporary list to hold group_sub strings for current row
-        for gene in row['target']:
-            if gene in df_reference_ontolgy['Gene'].values:
-                group = df_reference_ontolgy.loc[df_reference_ontolgy['Gene'] == gene, 'Group'].values[0]
-                sub = df_reference_ontolgy.loc[df_reference_ontolgy['Gene'] == gene, 'Sub'].values[0]
-                group_sub_string = f"{group} | {sub}"
-                if group_sub_string not in group_sub_list:
-                    group_sub_list.append(group_sub_string)
-                
-                # Append to rows_to_append
-                rows_to_append.append({
-                    'Compound': row['name'],
-                    'Group': group,
-                    'Sub': sub,
-                    'Gene': gene
-                })
-            else:
-                if gene not in genes_not_in_manual_ontology:
-                    genes_not_in_manual_ontology.append(gene)
-    
-        # Join all group_sub strings for the current row and update dm_merged
-        dm_merged.at[i, 'group_sub'] = group_sub_list
+    # explode the targets once and join them against the gene indexed ontology
+    dm_merged['group_sub'], cmp_trgt_grp, genes_not_in_manual_ontology = load_ontology().annotate(
+        dm_merged['target'], dm_merged['name']
+    )
 
-    # Convert rows_to_append to DataFrame
-    cmp_trgt_grp = pd.DataFrame(rows_to_append)
+    # per compound outlier flag: modified z-score of the S' of a line among all lines of the compound
+    dm_merged['s_prime_modified_z'] = grouped_modified_z_scores(dm_merged['S\''], dm_merged['name'])
+    dm_merged['s_prime_outlier'] = dm_merged['s_prime_modified_z'].abs() > MODIFIED_Z_OUTLIER
 
 ##########################################################################
     # dm_merged = pd.merge(df, filtered_gene_values, left_on='row_name', right_on='Unnamed: 0', how='inner');
@@ -170,6 +139,8 @@ def filter_df(active_gene, tissue):
     return dm_merged.loc[dm_merged['tissue'] == tissue], cmp_trgt_grp, genes_not_in_manual_ontology
 
 dm_merged, cmp_trgt_grp, genes_not_in_manual_ontology = filter_df(active_gene, tissue)
+# the tables below are derived from the files and these choices only
+dm_key = (prism_key, mutations_key, tuple(studies), active_gene, tissue)
 
 # for each cmopoumd unique by name:
 # name, tissue
@@ -179,75 +150,42 @@ dm_merged, cmp_trgt_grp, genes_not_in_manual_ontology = filter_df(active_gene, t
 st.dataframe(dm_merged)
 
 if not dm_merged.empty:
-    st.download_button(
-                label="Download data as CSV",
-                data=dm_merged.to_csv().encode('utf-8'),
-                file_name='s_prime.csv',
-                mime='text/csv'
-            )
+    download_section(dm_merged, file_name='s_prime.csv', key='download-dm-merged', cache_key=dm_key)
 
     st.header("Pooled Delta S' for Selected Values")
 
-    def median_absolute_deviation(data):
-        # Calculate the median of the data
-        median = np.median(data)
-        # Calculate the absolute deviations from the median
-        abs_deviation = np.abs(data - median)
-        # Compute the median of the absolute deviations
-        mad = np.median(abs_deviation)
-        return mad
-
-    def calculate_modified_z_score(data: pd.DataFrame, column: str) -> pd.Series:
-        """
-        Calculate the modified z-scores for a specified column in the DataFrame.
-
-        Parameters:
-        data (pd.DataFrame): Input DataFrame.
-        column (str): The name of the column for which to calculate the modified z-scores.
-
-        Returns:
-        pd.Series: A Series of modified z-scores for the specified column.
-        """
-        # Compute the median of the column
-        median = data[column].median()
-        
-        # Compute the Median Absolute Deviation (MAD)
-        mad = np.median(np.abs(data[column] - median))
-        
-        # Handle division by zero (if MAD is zero)
-        if mad == 0:
-            return pd.Series([0] * len(data[column]), index=data.index)
-        
-        # Compute the modified z-scores
-        modified_z_scores = 0.6745 * ((data[column] - median) / mad)
-        
-        return modified_z_scores
-
     def compute_compounds_test_agg(active_gene):
-        df_ref_group = dm_merged.loc[dm_merged[active_gene] == 0]
-        df_test_group = dm_merged.loc[dm_merged[active_gene] == 2]
+        df_groups = dm_merged.loc[dm_merged[active_gene].isin([0, 2])]
+        group = pd.Series(np.where(df_groups[active_gene] == 0, 'ref', 'test'), index=df_groups.index)
+        keys = [df_groups['name'], group]
+
+        # median, MAD, mean, variance and count of S' per (compound, group) in one pass
+        s_prime_stats = grouped_robust_stats(df_groups['S\''], keys)
+        pooled = df_groups.groupby(keys).agg(
+            pooled_auc=pd.NamedAgg(column='auc', aggfunc='mean'),
+            pooled_ec50=pd.NamedAgg(column='ec50', aggfunc='mean'),
+            num_lines=pd.NamedAgg(column='row_name', aggfunc='count'),
+        )
+
+        def group_agg(prefix):
+            # per compound columns of one group, named and ordered as in the exported table
+            group_s_prime = s_prime_stats.loc[s_prime_stats.index.get_level_values(1) == prefix].droplevel(1)
+            group_pooled = pooled.loc[pooled.index.get_level_values(1) == prefix].droplevel(1)
+            return pd.DataFrame({
+                f'{prefix}_pooled_s_prime': group_s_prime['mean'],
+                f'{prefix}_median_s_prime': group_s_prime['median'],
+                f'{prefix}_mad': group_s_prime['mad'],
+                f'{prefix}_pooled_auc': group_pooled['pooled_auc'],
+                f'{prefix}_pooled_ec50': group_pooled['pooled_ec50'],
+                f'num_{prefix}_lines': group_pooled['num_lines'],
+                f'{prefix}_s_prime_variance': group_s_prime['var'],
+            }).rename_axis('name').reset_index()
 
         # Reference group calculations
-        compounds_ref_agg_mean = df_ref_group.groupby('name').agg(
-            ref_pooled_s_prime=pd.NamedAgg(column='S\'', aggfunc='mean'),
-            ref_median_s_prime=pd.NamedAgg(column='S\'', aggfunc='median'),
-            ref_mad=pd.NamedAgg(column='S\'', aggfunc=median_absolute_deviation),
-            ref_pooled_auc=pd.NamedAgg(column='auc', aggfunc='mean'),
-            ref_pooled_ec50=pd.NamedAgg(column='ec50', aggfunc='mean'),
-            num_ref_lines=pd.NamedAgg(column='row_name', aggfunc='count'),
-            ref_s_prime_variance=pd.NamedAgg(column='S\'', aggfunc='var')
-        ).reset_index()
+        compounds_ref_agg_mean = group_agg('ref')
 
         # Test group calculations
-        compounds_test_agg_mean = df_test_group.groupby('name').agg(
-            test_pooled_s_prime=pd.NamedAgg(column='S\'', aggfunc='mean'),
-            test_median_s_prime=pd.NamedAgg(column='S\'', aggfunc='median'),
-            test_mad=pd.NamedAgg(column='S\'', aggfunc=median_absolute_deviation),
-            test_pooled_auc=pd.NamedAgg(column='auc', aggfunc='mean'),
-            test_pooled_ec50=pd.NamedAgg(column='ec50', aggfunc='mean'),
-            num_test_lines=pd.NamedAgg(column='row_name', aggfunc='count'),
-            test_s_prime_variance=pd.NamedAgg(column='S\'', aggfunc='var')
-        ).reset_index()
+        compounds_test_agg_mean = group_agg('test')
 
         # Merging reference and test data
         compounds_merge = pd.merge(compounds_ref_agg_mean, compounds_test_agg_mean, on='name', how='inner')
@@ -260,15 +198,10 @@ if not dm_merged.empty:
         # Additional calculations for median differences
         compounds_merge['delta_s_prime_median'] = compounds_merge['ref_median_s_prime'] - compounds_merge['test_median_s_prime']
 
-        # Calculate p-value using Mann-Whitney U test
-        p_values = []
-        for index, row in compounds_merge.iterrows():
-            group1 = df_ref_group[df_ref_group['name'] == row['name']]['S\'']
-            group2 = df_test_group[df_test_group['name'] == row['name']]['S\'']
-            stat, p_value = mannwhitneyu(group1, group2, alternative='two-sided')
-            p_values.append(p_value)
-
-        compounds_merge['p_val_median_man_whit'] = p_values
+        # Mann-Whitney U test of every compound in one pass, with Benjamini-Hochberg adjusted p-values
+        mwu = grouped_mannwhitneyu(df_groups['name'], df_groups['S\''], group == 'ref')
+        compounds_merge['p_val_median_man_whit'] = compounds_merge['name'].map(mwu['p_value'])
+        compounds_merge['p_val_median_man_whit_bh'] = benjamini_hochberg(compounds_merge['p_val_median_man_whit'])
 
 
         # Sensitivity calculations
@@ -297,13 +230,9 @@ if not dm_merged.empty:
 
     st.write(compounds_merge)
 
-    st.download_button(
-                label="Download data as CSV",
-                data=compounds_merge.to_csv().encode('utf-8'),
-                file_name='delta_s_prime.csv',
-                mime='text/csv',
-                key='download-compounds-merged'
-            )
+    download_section(
+        compounds_merge, file_name='delta_s_prime.csv', key='download-compounds-merged', cache_key=dm_key
+    )
 
     with st.expander("Target Grouping"):
         st.write(cmp_trgt_grp)
@@ -316,11 +245,7 @@ if not dm_merged.empty:
     st.header("Pooled Delta S' for Compounds By \"Group | Subgroup\" Combination")
 
     def get_unique_combinations():
-        target = fetch_df('Manual_ontology.csv')
-        target['Group'] = target['Group'].ffill()
-        target['Group_Subgroup'] = target['Group'] + ' | ' + target['Sub']
-        unique_combinations = target['Group_Subgroup'].unique()
-        return unique_combinations
+        return load_ontology().group_subs
     unique_combinations = get_unique_combinations()
 
     selected_combinations = st.multiselect(label='Choose Group | Subgroup combinations', options=unique_combinations)
@@ -0,0 +1,179 @@
+"""
+Persistent columnar cache for tabular source files.
+
+A cached table is a directory holding one ``.npy`` file per column plus a
+``meta.json`` describing the columns and the fingerprint of the source file
+it was built from. Numeric columns are stored with their native dtype and
+can be loaded memory-mapped, so a warm start is a typed read with no text
+parsing. The cache is rebuilt whenever the source file's fingerprint
+(path, size and modification time) changes.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# name of the cache directory, next to the source files
+CACHE_DIR_NAME = ".cache"
+
+META_FILE_NAME = "meta.json"
+
+
+def file_fingerprint(file_path):
+    """Return a fingerprint for a file based on its path, size and mtime"""
+    stat = os.stat(file_path)
+    return {
+        "path": str(Path(file_path).resolve()),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def cache_key(file_path):
+    """Name of the cache directory for a source file"""
+    resolved = str(Path(file_path).resolve())
+    digest = hashlib.sha1(resolved.encode("utf-8")).hexdigest()[:16]
+    return f"{Path(file_path).name}.{digest}"
+
+
+@contextmanager
+def atomic_directory(dir_path):
+    """Write a directory atomically, yields the temporary directory to fill
+
+    The temporary directory is created next to ``dir_path`` and moved into
+    place when the block exits, so a reader never sees a partially written
+    directory. It is removed if the block raises.
+    """
+    dir_path = Path(dir_path)
+    dir_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = Path(tempfile.mkdtemp(prefix=dir_path.name, dir=dir_path.parent))
+    try:
+        yield tmp_path
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    if dir_path.exists():
+        shutil.rmtree(dir_path, ignore_errors=True)
+    try:
+        os.replace(tmp_path, dir_path)
+    except OSError:
+        # another reader rebuilt the same directory concurrently, keep theirs
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def _column_kind(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return "cat"
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return "bool"
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        return "num"
+    return "str"
+
+
+def save_frame(df, cache_path, fingerprint):
+    """Write a dataframe to a columnar cache directory
+
+    The directory is written with ``atomic_directory``, a reader never sees
+    a partially written cache.
+    """
+    with atomic_directory(cache_path) as tmp_path:
+        columns = []
+        for ii, col in enumerate(df.columns):
+            series = df[col]
+            kind = _column_kind(series)
+            base = f"c{ii}"
+            if kind == "cat":
+                np.save(tmp_path / f"{base}.npy", series.cat.codes.values)
+                np.save(
+                    tmp_path / f"{base}_cats.npy",
+                    series.cat.categories.astype(str).values.astype(str),
+                )
+            elif kind == "str":
+                mask = series.isna().values
+                values = series.where(~mask, "").astype(str).values.astype(str)
+                np.save(tmp_path / f"{base}.npy", values)
+                np.save(tmp_path / f"{base}_mask.npy", mask)
+            else:
+                np.save(tmp_path / f"{base}.npy", series.values)
+            columns.append({"name": str(col), "kind": kind, "file": base})
+
+        meta = {
+            "fingerprint": fingerprint,
+            "n_rows": len(df),
+            "columns": columns,
+        }
+        with open(tmp_path / META_FILE_NAME, "w") as fp:
+            json.dump(meta, fp)
+
+
+def read_meta(cache_path):
+    """Return the metadata of a cache directory or None if it is missing"""
+    meta_path = Path(cache_path) / META_FILE_NAME
+    if not meta_path.exists():
+        return None
+    with open(meta_path) as fp:
+        return json.load(fp)
+
+
+def load_frame(cache_path, fingerprint=None, columns=None, mmap_mode=None):
+    """Load a dataframe from a columnar cache directory
+
+    Returns None if the cache is missing or was built from a different
+    version of the source file. With ``mmap_mode="r"`` numeric columns are
+    backed by the files on disk instead of being read into memory.
+    """
+    meta = read_meta(cache_path)
+    if meta is None:
+        return None
+    if fingerprint is not None and meta["fingerprint"] != fingerprint:
+        return None
+
+    cache_path = Path(cache_path)
+    data = {}
+    for col in meta["columns"]:
+        if columns is not None and col["name"] not in columns:
+            continue
+        values = np.load(cache_path / f"{col['file']}.npy", mmap_mode=mmap_mode)
+        if col["kind"] == "cat":
+            categories = np.load(cache_path / f"{col['file']}_cats.npy")
+            data[col["name"]] = pd.Categorical.from_codes(
+                np.asarray(values), categories=categories
+            )
+        elif col["kind"] == "str":
+            mask = np.load(cache_path / f"{col['file']}_mask.npy")
+            values = np.asarray(values).astype(object)
+            values[mask] = np.nan
+            data[col["name"]] = values
+        else:
+            data[col["name"]] = values
+
+    return pd.DataFrame(data, copy=False)
+
+
+def cached_read_csv(file_path, cache_dir, **kwargs):
+    """Read a csv file through the columnar cache
+
+    The first read parses the csv with ``pd.read_csv(file_path, **kwargs)``
+    and stores the result under ``cache_dir``. Later reads load the typed
+    columns directly as long as the source file is unchanged.
+    """
+    fingerprint = file_fingerprint(file_path)
+    fingerprint["read_kwargs"] = repr(sorted(kwargs.items()))
+    cache_path = Path(cache_dir) / cache_key(file_path)
+
+    df = load_frame(cache_path, fingerprint)
+    if df is not None:
+        return df
+
+    df = pd.read_csv(file_path, **kwargs)
+    save_frame(df, cache_path, fingerprint)
+    return df
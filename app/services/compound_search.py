@@ -0,0 +1,98 @@
+"""
+Server side compound search.
+
+``CompoundIndex`` tokenizes the searchable columns of the compound table
+once and keeps a sorted token list with the rows of every token, so a
+query is a few binary searches (prefix match) and an intersection of row
+arrays instead of a scan of the whole table in the browser. Results are
+returned one page at a time and without the SMILES column unless asked.
+"""
+
+import re
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+SEARCH_COLUMNS = ["NCGC SID", "name", "target", "MoA"]
+SMILES_COLUMN = "SMILES"
+DEFAULT_PAGE_SIZE = 50
+
+TOKEN_PATTERN = r"[a-z0-9]+"
+
+
+def tokenize(text):
+    """Lower case alphanumeric tokens of a query or a field"""
+    return re.findall(TOKEN_PATTERN, str(text).lower())
+
+
+class CompoundIndex:
+    """Token/prefix index over the searchable columns of a compound table
+
+    - tokens: sorted list of distinct tokens
+    - rows, offsets: row positions of all tokens in token order, the rows of
+      ``tokens[ii]`` are ``rows[offsets[ii]:offsets[ii + 1]]``, so the rows of
+      every token sharing a prefix are one contiguous slice
+    """
+
+    def __init__(self, df_compounds, columns=SEARCH_COLUMNS):
+        self.df_compounds = df_compounds
+        self.columns = [col for col in columns if col in df_compounds.columns]
+
+        # one (row position, token) pair per token in any searchable column
+        tokens = pd.concat(
+            [
+                df_compounds[col]
+                .reset_index(drop=True)
+                .astype("string")
+                .str.lower()
+                .str.findall(TOKEN_PATTERN)
+                .explode()
+                .dropna()
+                for col in self.columns
+            ]
+        )
+        df_tokens = pd.DataFrame(
+            {"token": tokens.to_numpy(dtype=str), "row": tokens.index.to_numpy(dtype=int)}
+        ).drop_duplicates().sort_values(["token", "row"])
+
+        tokens, starts = np.unique(df_tokens["token"].to_numpy(), return_index=True)
+        self.tokens = tokens.tolist()
+        self.rows = df_tokens["row"].to_numpy()
+        self.offsets = np.append(starts, len(self.rows))
+
+    def __len__(self):
+        return len(self.df_compounds)
+
+    def _prefix_rows(self, prefix):
+        lo = bisect_left(self.tokens, prefix)
+        hi = bisect_left(self.tokens, prefix + "\uffff")
+        return np.unique(self.rows[self.offsets[lo]:self.offsets[hi]])
+
+    def search(self, query):
+        """Row positions (sorted) matching every token of ``query`` as a prefix
+
+        An empty query matches every row.
+        """
+        rows = np.arange(len(self.df_compounds))
+        for token in tokenize(query):
+            rows = np.intersect1d(rows, self._prefix_rows(token), assume_unique=True)
+            if len(rows) == 0:
+                break
+        return rows
+
+    def page(self, rows, page=0, page_size=DEFAULT_PAGE_SIZE, with_smiles=False):
+        """Compound rows of one page of a search result
+
+        The SMILES column is only included with ``with_smiles=True``.
+        """
+        columns = [
+            col for col in self.df_compounds.columns
+            if with_smiles or col != SMILES_COLUMN
+        ]
+        start = page * page_size
+        return self.df_compounds.iloc[rows[start:start + page_size]][columns]
+
+
+def n_pages(n_rows, page_size=DEFAULT_PAGE_SIZE):
+    return max(int(np.ceil(n_rows / page_size)), 1)
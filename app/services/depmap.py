@@ -0,0 +1,202 @@
+"""
+DepMap PRISM secondary screen dose response parameters and the damaging
+mutations matrix of the cell lines.
+
+``load_prism_table`` parses the csv once, derives EFF, EFF*100, EFF/EC50,
+S' and the ccle / tissue split, and stores the typed result in a columnar
+cache next to the file (see ``services.columnar_cache``). Later loads read
+the cache memory-mapped: the float32 metrics are backed by the files on
+disk and the string columns are categoricals.
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from services.columnar_cache import (
+    CACHE_DIR_NAME,
+    META_FILE_NAME,
+    atomic_directory,
+    cache_key,
+    file_fingerprint,
+    load_frame,
+    read_meta,
+    save_frame,
+)
+
+# bump when the derived columns or dtypes change, invalidates existing caches
+PRISM_CACHE_VERSION = 1
+
+PRISM_FILE = Path("data/DepMap/Prism19Q4/secondary-screen-dose-response-curve-parameters.csv")
+
+# columns read from the file, in the order of the resulting table
+PRISM_COLS = [
+    "name",
+    "moa",
+    "target",
+    "lower_limit",
+    "upper_limit",
+    "ec50",
+    "auc",
+    "ccle_name",
+    "row_name",
+    "screen_id",
+]
+PRISM_FLOAT_COLS = ["lower_limit", "upper_limit", "ec50", "auc"]
+PRISM_DERIVED_FLOAT_COLS = ["EFF", "EFF*100", "EFF/EC50", "S'"]
+# every string column repeats a few thousand compounds or a few hundred lines
+PRISM_CATEGORICAL_COLS = ["name", "moa", "target", "ccle_name", "row_name", "screen_id", "ccle", "tissue"]
+
+
+def build_prism_table(file_path):
+    """Parse the PRISM csv and derive the S' and tissue columns
+
+    Derived metrics are computed in float64 and stored as float32.
+    """
+    df = pd.read_csv(file_path, usecols=PRISM_COLS)[PRISM_COLS]
+
+    # Derive EFF (upper_limit - lower_limit)
+    df["EFF"] = df["upper_limit"] - df["lower_limit"]
+    # Derive EFF*100
+    df["EFF*100"] = df["EFF"] * 100
+    # Derive EFF/EC50
+    df["EFF/EC50"] = df["EFF"] / df["ec50"]
+    # Derive S'
+    # ASINH((EFF*100)/EC50)
+    df["S'"] = np.arcsinh(df["EFF*100"] / df["ec50"])
+
+    df[["ccle", "tissue"]] = df["ccle_name"].str.split("_", n=1, expand=True)
+
+    float_cols = PRISM_FLOAT_COLS + PRISM_DERIVED_FLOAT_COLS
+    df[float_cols] = df[float_cols].astype(np.float32)
+    df[PRISM_CATEGORICAL_COLS] = df[PRISM_CATEGORICAL_COLS].astype("category")
+    return df
+
+
+def prism_fingerprint(file_path):
+    fingerprint = file_fingerprint(file_path)
+    fingerprint["version"] = PRISM_CACHE_VERSION
+    return fingerprint
+
+
+def load_prism_table(file_path=PRISM_FILE, cache_dir=None, mmap_mode="r"):
+    """The PRISM table, built on first use and memory-mapped afterwards
+
+    The cache lives in ``cache_dir`` (default: ``.cache`` next to the file)
+    and is rebuilt when the file changes. Do not modify the returned numeric
+    columns in place, they are read-only maps of the cache files.
+    """
+    file_path = Path(file_path)
+    if cache_dir is None:
+        cache_dir = file_path.parent / CACHE_DIR_NAME
+    cache_path = Path(cache_dir) / cache_key(file_path)
+    fingerprint = prism_fingerprint(file_path)
+
+    df = load_frame(cache_path, fingerprint, mmap_mode=mmap_mode)
+    if df is not None:
+        return df
+
+    save_frame(build_prism_table(file_path), cache_path, fingerprint)
+    return load_frame(cache_path, fingerprint, mmap_mode=mmap_mode)
+
+
+# Damaging mutations matrix
+# ==================================
+
+MUTATIONS_FILE = Path("data/DepMap/Public24Q2/OmicsSomaticMutationsMatrixDamaging.csv")
+
+# bump when the store layout changes, invalidates existing stores
+MUTATIONS_STORE_VERSION = 1
+
+# stored value of a missing (NaN) entry
+MUTATION_MISSING = -1
+
+MUTATIONS_LINES_FILE = "lines.npy"
+MUTATIONS_VALUES_FILE = "values.npy"
+
+
+class MutationStore:
+    """Cell line x gene damaging mutation counts, read one gene at a time
+
+    The counts are one int8 (n_lines x n_genes) ``.npy`` in Fortran order,
+    so every gene is a contiguous block of n_lines bytes in a memory-mapped
+    file. Missing entries are ``MUTATION_MISSING``. Opening the store only
+    reads the metadata (gene names) and the line ids.
+    """
+
+    def __init__(self, store_path, mmap_mode="r"):
+        store_path = Path(store_path)
+        with open(store_path / META_FILE_NAME) as fp:
+            meta = json.load(fp)
+        self.line_id_col = meta["line_id_col"]
+        self.genes = meta["genes"]
+        self.gene_index = {gene: ii for ii, gene in enumerate(self.genes)}
+        self.line_ids = np.load(store_path / MUTATIONS_LINES_FILE).astype(object)
+        self.values = np.load(store_path / MUTATIONS_VALUES_FILE, mmap_mode=mmap_mode)
+
+    def gene(self, gene):
+        """Counts of one gene for every line, shape (n_lines,)"""
+        return np.array(self.values[:, self.gene_index[gene]])
+
+    def gene_frame(self, gene):
+        """Line ids and the counts of one gene, with the columns of the csv"""
+        return pd.DataFrame({self.line_id_col: self.line_ids, gene: self.gene(gene)})
+
+
+def read_mutations_csv(file_path):
+    """Line id column name, line ids, gene names and the int8 counts of the csv"""
+    df = pd.read_csv(file_path, index_col=0)
+    # the unnamed first column, as pandas names it when reading the csv as is
+    line_id_col = pd.read_csv(file_path, nrows=0).columns[0]
+
+    values = df.to_numpy(dtype=np.float32)
+    missing = np.isnan(values)
+    counts = np.where(missing, 0, values)
+    if (counts != np.round(counts)).any() or counts.min() < 0 or counts.max() > np.iinfo(np.int8).max:
+        raise ValueError(f"{file_path} does not hold small non negative mutation counts")
+    counts = counts.astype(np.int8)
+    counts[missing] = MUTATION_MISSING
+    return line_id_col, df.index.to_numpy(dtype=str), list(df.columns), counts
+
+
+def build_mutation_store(file_path, store_path, fingerprint):
+    """Convert the mutations csv into a ``MutationStore`` directory
+
+    Written with ``columnar_cache.atomic_directory``.
+    """
+    line_id_col, line_ids, genes, counts = read_mutations_csv(file_path)
+
+    with atomic_directory(store_path) as tmp_path:
+        np.save(tmp_path / MUTATIONS_LINES_FILE, line_ids)
+        np.save(tmp_path / MUTATIONS_VALUES_FILE, np.asfortranarray(counts))
+        with open(tmp_path / META_FILE_NAME, "w") as fp:
+            json.dump(
+                {"fingerprint": fingerprint, "line_id_col": line_id_col, "genes": genes},
+                fp,
+            )
+
+
+def mutations_fingerprint(file_path):
+    fingerprint = file_fingerprint(file_path)
+    fingerprint["version"] = MUTATIONS_STORE_VERSION
+    return fingerprint
+
+
+def load_mutation_store(file_path=MUTATIONS_FILE, cache_dir=None, mmap_mode="r"):
+    """The ``MutationStore`` of the csv, built on first use
+
+    The store lives in ``cache_dir`` (default: ``.cache`` next to the file)
+    and is rebuilt when the file changes.
+    """
+    file_path = Path(file_path)
+    if cache_dir is None:
+        cache_dir = file_path.parent / CACHE_DIR_NAME
+    store_path = Path(cache_dir) / cache_key(file_path)
+    fingerprint = mutations_fingerprint(file_path)
+
+    meta = read_meta(store_path)
+    if meta is None or meta["fingerprint"] != fingerprint:
+        build_mutation_store(file_path, store_path, fingerprint)
+    return MutationStore(store_path, mmap_mode=mmap_mode)
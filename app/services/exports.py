@@ -0,0 +1,64 @@
+"""
+Table exports for the download buttons.
+
+Tables are serialized only when a download is requested. The bytes are
+keyed by a content fingerprint of the table (``frame_fingerprint``), so the
+same table is serialized once per format no matter how many reruns or
+sessions ask for it.
+"""
+
+import gzip
+import hashlib
+import io
+
+import pandas as pd
+
+# format -> (label, file extension, mime type)
+EXPORT_FORMATS = {
+    "csv": ("CSV", ".csv", "text/csv"),
+    "csv.gz": ("CSV (gzip)", ".csv.gz", "application/gzip"),
+    "parquet": ("Parquet", ".parquet", "application/vnd.apache.parquet"),
+}
+
+
+def flatten_list_columns(df):
+    """Store list valued columns (e.g. the per line values of a ranking) as text"""
+    list_cols = [
+        col for col in df.columns
+        if df[col].dtype == object and df[col].map(type).eq(list).any()
+    ]
+    if not list_cols:
+        return df
+    return df.assign(**{col: df[col].map(str) for col in list_cols})
+
+
+def frame_fingerprint(df):
+    """Hex digest of the columns, dtypes, index and values of a dataframe"""
+    df = flatten_list_columns(df)
+    digest = hashlib.sha1()
+    digest.update(repr((list(df.columns), [str(dtype) for dtype in df.dtypes])).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+def export_bytes(df, file_format="csv"):
+    """Serialize a dataframe to one of ``EXPORT_FORMATS``
+
+    Parquet needs pyarrow (or fastparquet).
+    """
+    if file_format == "csv":
+        return df.to_csv().encode("utf-8")
+    if file_format == "csv.gz":
+        # fixed mtime so the same table always gives the same bytes
+        return gzip.compress(df.to_csv().encode("utf-8"), mtime=0)
+    if file_format == "parquet":
+        buffer = io.BytesIO()
+        flatten_list_columns(df).to_parquet(buffer)
+        return buffer.getvalue()
+    raise ValueError(f"Unknown export format {file_format!r}, expected one of {list(EXPORT_FORMATS)}")
+
+
+def export_file_name(file_name, file_format="csv"):
+    """``file_name`` with the extension of ``file_format`` (a .csv suffix is replaced)"""
+    stem = file_name[:-len(".csv")] if file_name.endswith(".csv") else file_name
+    return stem + EXPORT_FORMATS[file_format][1]
@@ -0,0 +1,168 @@
+"""
+Per compound statistics of two groups of cell lines (reference and test).
+
+``grouped_mannwhitneyu`` runs the Mann-Whitney U test of every compound in
+one pass: the values are ranked within each compound once, the U statistics
+are sums of ranks per (compound, group) and the p-values use the normal
+approximation with tie and continuity correction, like
+``scipy.stats.mannwhitneyu``. Small groups without ties get the exact
+p-value from the null distribution of their group sizes, built once per
+distinct pair of sizes, so the results match a per compound
+``mannwhitneyu`` call.
+
+``grouped_robust_stats`` and ``grouped_modified_z_scores`` compute the
+median, MAD and the modified z-scores per group with pandas' built-in
+grouped medians (``transform("median")``) rather than a Python aggfunc.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# scipy uses the exact distribution when one group has at most this many
+# values and there are no ties
+MWU_EXACT_MAX_N = 8
+
+# modified z-score above which a value is flagged as an outlier (Iglewicz and Hoaglin)
+MODIFIED_Z_OUTLIER = 3.5
+
+
+def grouped_mannwhitneyu(keys, values, is_ref, use_continuity=True):
+    """Two-sided Mann-Whitney U test of the reference vs test values per key
+
+    ``keys``, ``values`` and the boolean ``is_ref`` are aligned arrays (one
+    entry per measurement). Only keys with values in both groups are tested.
+    Returns a DataFrame indexed by key (sorted) with n_ref, n_test, the U
+    statistic of the reference group ``u_stat`` and ``p_value``. Keys with a
+    NaN value get NaN, as with ``mannwhitneyu``'s default ``nan_policy``.
+    """
+    df = pd.DataFrame(
+        {
+            "key": np.asarray(keys),
+            "value": np.asarray(values, dtype=np.float64),
+            "is_ref": np.asarray(is_ref, dtype=bool),
+        }
+    )
+    groups = df.groupby("key", sort=True)
+    df["rank"] = groups["value"].rank(method="average")
+
+    df_stats = pd.DataFrame(
+        {
+            "n_ref": groups["is_ref"].sum(),
+            "n": groups["value"].size(),
+            "has_nan": df["value"].isna().groupby(df["key"], sort=True).any(),
+            "rank_sum_ref": df["rank"].where(df["is_ref"], 0).groupby(df["key"], sort=True).sum(),
+        }
+    )
+    df_stats["n_test"] = df_stats["n"] - df_stats["n_ref"]
+    df_stats = df_stats.loc[(df_stats["n_ref"] > 0) & (df_stats["n_test"] > 0)]
+
+    # sum of t^3 - t over the runs of t tied values of every key
+    ties = df.groupby(["key", "value"], sort=False).size()
+    tie_term = (ties ** 3 - ties).groupby(level="key").sum()
+    df_stats["max_tie"] = ties.groupby(level="key").max()
+    tie_term = tie_term.reindex(df_stats.index).to_numpy(dtype=np.float64)
+
+    n1 = df_stats["n_ref"].to_numpy(dtype=np.float64)
+    n2 = df_stats["n_test"].to_numpy(dtype=np.float64)
+    n = n1 + n2
+    u1 = df_stats["rank_sum_ref"].to_numpy() - n1 * (n1 + 1) / 2
+    u = np.maximum(u1, n1 * n2 - u1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sigma = np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+        z = (u - n1 * n2 / 2 - (0.5 if use_continuity else 0)) / sigma
+    p_values = np.clip(2 * stats.norm.sf(z), 0, 1)
+
+    # exact p-values of the small groups without ties, looked up in the null
+    # distribution of their group sizes (built once per distinct pair of sizes)
+    exact = (
+        (np.minimum(n1, n2) <= MWU_EXACT_MAX_N)
+        & (df_stats["max_tie"].to_numpy() == 1)
+        & ~df_stats["has_nan"].to_numpy(dtype=bool)
+    )
+    if exact.any():
+        p_exact = np.empty(exact.sum())
+        sizes = np.stack([np.minimum(n1, n2), np.maximum(n1, n2)], axis=1)[exact].astype(np.int64)
+        u_exact = np.rint(u[exact]).astype(np.int64)
+        pairs, pair_index = np.unique(sizes, axis=0, return_inverse=True)
+        for ii, (n_small, n_large) in enumerate(pairs):
+            in_pair = pair_index.ravel() == ii
+            p_exact[in_pair] = 2 * mwu_exact_sf(int(n_small), int(n_large))[u_exact[in_pair]]
+        p_values[exact] = np.minimum(p_exact, 1)
+
+    result = pd.DataFrame(
+        {"n_ref": df_stats["n_ref"], "n_test": df_stats["n_test"], "u_stat": u1, "p_value": p_values},
+        index=df_stats.index,
+    )
+
+    result.loc[df_stats["has_nan"].to_numpy(dtype=bool), ["u_stat", "p_value"]] = np.nan
+    return result
+
+
+@lru_cache(maxsize=256)
+def mwu_exact_sf(m, n):
+    """Exact null survival function of the U statistic for group sizes m <= n
+
+    Returns ``sf`` with ``sf[u] = P(U >= u)`` for u in 0..m*n, assuming no
+    ties. The counts follow the recurrence
+    f(k, j, u) = f(k - 1, j, u - j) + f(k, j - 1, u) (is the largest value
+    in the first or the second group), kept for every k <= m while j grows
+    to n. Do not modify the returned array, it is cached.
+    """
+    counts = [np.ones(1) for _ in range(m + 1)]
+    for j in range(1, n + 1):
+        for k in range(1, m + 1):
+            new = np.zeros(k * j + 1)
+            new[: len(counts[k])] = counts[k]
+            new[j:] += counts[k - 1]
+            counts[k] = new
+    sf = np.cumsum(counts[m][::-1])[::-1]
+    return sf / sf[0]
+
+
+def benjamini_hochberg(p_values):
+    """Benjamini-Hochberg adjusted p-values (NaN entries are left out and kept NaN)"""
+    p_values = np.asarray(p_values, dtype=np.float64)
+    adjusted = np.full_like(p_values, np.nan)
+    valid = np.flatnonzero(~np.isnan(p_values))
+    if len(valid) == 0:
+        return adjusted
+
+    order = valid[np.argsort(p_values[valid])]
+    ranked = p_values[order] * len(order) / np.arange(1, len(order) + 1)
+    # enforce monotonicity from the largest p-value down
+    adjusted[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1)
+    return adjusted
+
+
+def grouped_robust_stats(values, keys):
+    """Median, MAD, mean, variance and count of ``values`` per group of ``keys``
+
+    ``keys`` is anything ``Series.groupby`` accepts (a Series or a list of
+    aligned Series). The MAD is the median of the absolute deviations from
+    the group median, computed with the built-in grouped medians instead of a
+    Python aggfunc. NaN values are skipped, as by the other statistics.
+    """
+    values = pd.Series(values, dtype=np.float64)
+    groups = values.groupby(keys, sort=True)
+    deviations = (values - groups.transform("median")).abs()
+    df_stats = groups.agg(["median", "mean", "var", "count"])
+    df_stats.insert(1, "mad", deviations.groupby(keys, sort=True).median())
+    return df_stats
+
+
+def grouped_modified_z_scores(values, keys):
+    """Modified z-score 0.6745 * (x - median) / MAD of every value within its group
+
+    Groups with a MAD of 0 get a score of 0 for every value.
+    """
+    values = pd.Series(values, dtype=np.float64)
+    medians = values.groupby(keys).transform("median")
+    deviations = values - medians
+    mads = deviations.abs().groupby(keys).transform("median")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = 0.6745 * deviations / mads
+    return scores.where(mads != 0, 0.0)
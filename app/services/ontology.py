@@ -0,0 +1,122 @@
+"""
+Manually curated ontology of gene targets (``Manual_ontology.csv``).
+
+The file lists one gene per row with its ``Sub`` group; ``Group`` is only
+filled on the first row of each group. ``load_ontology`` reads it once per
+process and precomputes the lookups used by the pages.
+"""
+
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+ONTOLOGY_FILE = Path(__file__).resolve().parent.parent / "Manual_ontology.csv"
+
+ONTOLOGY_COLS = ["Group", "Sub", "Gene"]
+
+
+def group_sub_label(group, sub):
+    return f"{group} | {sub}"
+
+
+class Ontology:
+    """Gene target ontology with precomputed lookups
+
+    - frame: Group, Sub, Gene in file order, Group stripped and forward filled
+    - gene_to_group_sub: {gene: (group, sub)}, the first row of a gene wins
+    - gene_table: Group, Sub and "group | sub" label indexed by gene (same rows)
+    - group_subs: distinct "group | sub" labels in file order
+    - group_sub_genes: {"group | sub": frozenset of genes}
+    - genes: distinct genes in file order, ``gene_index`` maps them to rows
+    - incidence: sparse (genes x group_subs) 0/1 matrix
+    """
+
+    def __init__(self, df_ontology):
+        df = df_ontology[ONTOLOGY_COLS].copy()
+        df["Group"] = df["Group"].map(lambda group: str(group).strip(), na_action="ignore").ffill()
+        df["group_sub"] = [group_sub_label(group, sub) for group, sub in zip(df["Group"], df["Sub"])]
+        self.frame = df[ONTOLOGY_COLS].reset_index(drop=True)
+
+        df_first = df.drop_duplicates("Gene")
+        self.gene_table = df_first.set_index("Gene")[["Group", "Sub", "group_sub"]]
+        self.gene_to_group_sub = dict(
+            zip(df_first["Gene"], zip(df_first["Group"], df_first["Sub"]))
+        )
+
+        self.group_subs = list(dict.fromkeys(df["group_sub"]))
+        self.group_sub_genes = {
+            group_sub: frozenset(genes)
+            for group_sub, genes in df.groupby("group_sub", sort=False)["Gene"]
+        }
+
+        self.genes = list(df_first["Gene"])
+        self.gene_index = {gene: ii for ii, gene in enumerate(self.genes)}
+        group_sub_index = {group_sub: jj for jj, group_sub in enumerate(self.group_subs)}
+        df_pairs = df[["Gene", "group_sub"]].drop_duplicates()
+        self.incidence = sparse.csr_matrix(
+            (
+                np.ones(len(df_pairs), dtype=np.int8),
+                (
+                    df_pairs["Gene"].map(self.gene_index).to_numpy(),
+                    df_pairs["group_sub"].map(group_sub_index).to_numpy(),
+                ),
+            ),
+            shape=(len(self.genes), len(self.group_subs)),
+        )
+
+    def __contains__(self, gene):
+        return gene in self.gene_to_group_sub
+
+    def annotate(self, targets, names):
+        """Ontology annotation of a table of compounds and their target genes
+
+        ``targets`` holds a list of genes per row and ``names`` the compound
+        names, on the same index. The targets are exploded once and mapped
+        through the gene lookups, returns:
+
+        - group_sub: Series of lists of distinct "group | sub" labels per
+          row (in target order, ``[]`` if no gene is known), on the index
+          of ``targets``
+        - cmp_trgt_grp: Compound, Group, Sub, Gene for every known target
+          gene, in row and target order
+        - unknown: genes not in the ontology, in order of first appearance
+        """
+        lengths = targets.map(len).to_numpy(dtype=np.int64)
+        rows = np.repeat(np.arange(len(targets)), lengths)
+        genes = pd.Series(
+            [gene for genes in targets for gene in genes], dtype=object
+        )
+
+        known = genes.isin(self.gene_table.index).to_numpy()
+        df_known = self.gene_table.loc[genes[known]].reset_index()
+        df_known["row"] = rows[known]
+        df_known["Compound"] = names.to_numpy()[rows[known]]
+
+        # exploded rows are in row order, so the labels of a row are one run
+        df_labels = df_known.drop_duplicates(["row", "group_sub"])
+        label_rows = df_labels["row"].to_numpy()
+        starts = np.flatnonzero(np.diff(label_rows, prepend=-1))
+        group_sub = pd.Series([[] for _ in range(len(targets))], index=targets.index, dtype=object)
+        if len(starts):
+            group_sub.iloc[label_rows[starts]] = [
+                labels.tolist() for labels in np.split(df_labels["group_sub"].to_numpy(), starts[1:])
+            ]
+
+        if len(df_known):
+            cmp_trgt_grp = df_known[["Compound", "Group", "Sub", "Gene"]]
+        else:
+            cmp_trgt_grp = pd.DataFrame()
+
+        # set difference with the ontology genes, kept in order of appearance
+        unknown = genes[~known].drop_duplicates().to_list()
+
+        return group_sub, cmp_trgt_grp, unknown
+
+
+@lru_cache(maxsize=None)
+def load_ontology(file_path=ONTOLOGY_FILE):
+    """The ontology in ``file_path``, read once per process"""
+    return Ontology(pd.read_csv(file_path))
@@ -38,7 +38,14 @@ files included in the dataset above are,
 
 """
 
+import argparse
+import functools
+import json
 import re
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, Iterable, List
 
@@ -46,9 +53,44 @@ import funcy
 import numpy as np
 import pandas as pd
 
+from services.columnar_cache import (
+    CACHE_DIR_NAME,
+    META_FILE_NAME,
+    atomic_directory,
+    cached_read_csv,
+    file_fingerprint,
+    load_frame,
+    save_frame,
+)
+from services.exports import flatten_list_columns
+
 import os 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
+# default number of workers used to read dose response curve files
+DEFAULT_READ_WORKERS = 8
+
+# name of the directory (inside the cache directory) holding the DrcStore
+DRC_STORE_DIR_NAME = "drc_store"
+
+# bump when the stored values or layout of the DrcStore change, invalidates existing stores
+DRC_STORE_VERSION = 1
+
+# iterations and damping of the batched Levenberg-Marquardt LL.4 fit
+LL4_MAX_ITER = 100
+LL4_INIT_DAMPING = 1e-3
+# bounds of the fit, the AC50 margin is in natural log units beyond the tested range
+LL4_MAX_HILL = 20.0
+LL4_LOG_AC50_MARGIN = 10.0
+
+# bootstrap resamples are drawn in chunks, a process pool is used above the threshold
+BOOTSTRAP_CHUNK_SIZE = 250
+BOOTSTRAP_PROCESS_MIN = 2000
+
+# compound metadata columns and per cell line fit parameters of the DrcStore
+COMPOUND_COLS = ["NCGC SID", "name", "target", "MoA", "SMILES"]
+DRC_PARAM_COLS = ["R2", "AC50", "LAC50", "HILL", "INF", "ZERO"]
+
 # standardized column names for response and concentration
 R_COLS = [f"DATA{ii}" for ii in range(11)]
 C_COLS = [f"CONC{ii}" for ii in range(11)]
@@ -159,84 +201,207 @@ num_sis_primary = [
 ]
 
 
+# Dose response curve file schemas
+# ==================================
+
+# canonical column -> candidate column names in the raw files (first match wins)
+DRC_COLUMN_CANDIDATES = {
+    "ncgc": ["NCGC SID", "NCGCID", "SID"],
+    "name": ["Name", "name"],
+    "target": ["Target", "target"],
+    "smiles": ["SMILES", "smi"],
+    "hill": ["HILL", "Hill"],
+    "inf": ["INF", "Infinity"],
+    "zero": ["ZERO", "Zero"],
+    "moa": ["MoA"],
+    "r2": ["R2"],
+    "ac50": ["AC50"],
+    "lac50": ["LAC50"],
+}
+DRC_REQUIRED_COLUMNS = ["ncgc", "name", "target", "smiles", "hill", "inf", "zero"]
+
+# (marker column, pattern) of the concentration and response columns,
+# the last matching marker wins
+DRC_CONC_PATTERNS = [("C1", r"C\d+"), ("CONC1", r"CONC\d+")]
+DRC_RESP_PATTERNS = [("DATA1", r"DATA\d+")]
+
+# columns read as categoricals, every other numeric column is read as float32
+DRC_CATEGORICAL_COLUMNS = ["target", "moa"]
+DRC_STRING_COLUMNS = ["ncgc", "name", "smiles"]
+
+# units of each file, the multipliers turn AC50 and concentrations into micromolars
+DRC_FILE_UNITS = {
+    # AC50 is in molar units
+    # concentration column is in micromolars
+    "molar_ac50": {
+        "ac50_mult": 1e6,
+        "c_mult": 1.0,
+        "files": [
+            "NTAP ipNF02.3 2l MIPE qHTS.csv",
+            "NTAP ipNF05.5 MC MIPE qHTS.csv",
+            "NTAP ipNF06.2A MIPE qHTS.csv",
+            "NTAP ipnNF95.11C MIPE qHTS.csv",
+            "NTAP ipNF02.8 MIPE qHTS.csv",
+            "NTAP ipNF95.11b C_T MIPE qHTS.csv",
+            "NTAP ipNF05.5 SC MIPE qHTS.csv",
+            "NTAP ipNF95.6 MIPE qHTS.csv",
+            "s-ntap-HFF-1.csv",
+            "s-ntap-MTC-1.csv",
+        ],
+    },
+    # AC50 is in micromolars
+    # concentration is in molar units
+    "molar_conc": {
+        "ac50_mult": 1.0,
+        "c_mult": 1e6,
+        "files": [
+            "NTAP_ipNF95.11bC_MIPE_qHTS.csv",
+            "s-ntap-IPNF95_11b_P53-1",
+            "s-ntap-HFF-1",
+            "s-ntap-IPNF06_2A_P27-1",
+            "s-ntap-IPNF95-1bc-1",
+            "s-ntap-1PNO-1",
+            "s-ntap-IPNF95_6_P53-1",
+            "s-ntap-IPNF05_5_P30-1",
+            "s-ntap-IPNF05_5_P31-1",
+            "s-ntap-ipn02.8-1",
+            "s-ntap-ipnNF95_11C_P31-1",
+        ],
+    },
+}
+
+
+class DrcSchema:
+    """Resolved column mapping and read dtypes of one file format
+
+    ``cols`` maps canonical names (see ``DRC_COLUMN_CANDIDATES``) to the raw
+    column names present in the format, ``cols_conc`` and ``cols_resp`` are
+    the 11 raw concentration and response columns.
+    """
+
+    def __init__(self, cols, cols_conc, cols_resp):
+        self.cols = cols
+        self.cols_conc = cols_conc
+        self.cols_resp = cols_resp
+
+    @property
+    def usecols(self):
+        return list(self.cols.values()) + self.cols_conc + self.cols_resp
+
+    @property
+    def dtypes(self):
+        dtypes = {}
+        for key, col in self.cols.items():
+            if key in DRC_CATEGORICAL_COLUMNS:
+                dtypes[col] = "category"
+            elif key in DRC_STRING_COLUMNS:
+                dtypes[col] = str
+            else:
+                dtypes[col] = np.float32
+        for col in self.cols_conc + self.cols_resp:
+            dtypes[col] = np.float32
+        return dtypes
+
+
+def _match_pattern_cols(columns, patterns):
+    cols = None
+    for marker, pattern in patterns:
+        if marker in columns:
+            cols = [col for col in columns if re.fullmatch(pattern, col)]
+    return cols
+
+
+@functools.lru_cache(maxsize=None)
+def resolve_drc_schema(columns):
+    """Resolve the schema of a file format from its (tuple of) column names
+
+    Raises a ValueError for files that miss required columns.
+    """
+    cols = {}
+    for key, candidates in DRC_COLUMN_CANDIDATES.items():
+        for col in candidates:
+            if col in columns:
+                cols[key] = col
+                break
+
+    missing = [key for key in DRC_REQUIRED_COLUMNS if key not in cols]
+    if "ac50" not in cols and "lac50" not in cols:
+        missing.append("ac50 or lac50")
+    if missing:
+        raise ValueError(f"dose response curve file is missing columns for {missing}")
+
+    cols_conc = _match_pattern_cols(columns, DRC_CONC_PATTERNS)
+    cols_resp = _match_pattern_cols(columns, DRC_RESP_PATTERNS)
+    for kind, found in [("concentration", cols_conc), ("response", cols_resp)]:
+        if found is None or len(found) != len(C_COLS):
+            raise ValueError(f"dose response curve file needs {len(C_COLS)} {kind} columns")
+
+    return DrcSchema(cols, cols_conc, cols_resp)
+
+
+def get_file_units(file_name):
+    """Multipliers (ac50_mult, c_mult) turning a file's units into micromolars"""
+    for units in DRC_FILE_UNITS.values():
+        if file_name in units["files"]:
+            return units["ac50_mult"], units["c_mult"]
+    raise ValueError(f"no units registered for {file_name}")
+
+
 class DoseResponseCurve:
     def __init__(self, smm_hts, df_raw):
         self.smm_hts = smm_hts
         self.df_raw = df_raw
+        self.schema = resolve_drc_schema(tuple(df_raw.columns))
 
         self.set_concentration_multipliers()
         self.create_df()
 
     @property
     def raw_col_hill(self):
-        for col in ["HILL", "Hill"]:
-            if col in self.df_raw.columns:
-                return col
+        return self.schema.cols["hill"]
 
     @property
     def raw_col_inf(self):
-        for col in ["INF", "Infinity"]:
-            if col in self.df_raw.columns:
-                return col
+        return self.schema.cols["inf"]
 
     @property
     def raw_col_zero(self):
-        for col in ["ZERO", "Zero"]:
-            if col in self.df_raw.columns:
-                return col
+        return self.schema.cols["zero"]
 
     @property
     def raw_col_name(self):
-        for col in ["Name", "name"]:
-            if col in self.df_raw.columns:
-                return col
+        return self.schema.cols["name"]
 
     @property
     def raw_col_target(self):
-        for col in ["Target", "target"]:
-            if col in self.df_raw.columns:
-                return col
+        return self.schema.cols["target"]
 
     @property
     def raw_col_ncgc(self):
-        for col in ["NCGC SID", "NCGCID", "SID"]:
-            if col in self.df_raw.columns:
-                return col
+        return self.schema.cols["ncgc"]
 
     @property
     def raw_col_smiles(self):
-        for col in ["SMILES", "smi"]:
-            if col in self.df_raw.columns:
-                return col
+        return self.schema.cols["smiles"]
 
     @property
     def raw_cols_conc(self):
-        if "C1" in self.df_raw.columns:
-            c_cols = [col for col in self.df_raw.columns if re.match("C\d+", col)]
-
-        if "CONC1" in self.df_raw.columns:
-            c_cols = [col for col in self.df_raw.columns if re.match("CONC\d+", col)]
-
-        assert len(c_cols) == 11
-        return c_cols
+        return self.schema.cols_conc
 
     @property
     def raw_cols_resp(self):
-        if "DATA1" in self.df_raw.columns:
-            r_cols = [col for col in self.df_raw.columns if re.match("DATA\d+", col)]
-
-        assert len(r_cols) == 11
-        return r_cols
+        return self.schema.cols_resp
 
     def create_df(self):
 
         self.df = pd.DataFrame()
         self.df["NCGC SID"] = self.df_raw[self.raw_col_ncgc]
         self.df["name"] = self.df_raw[self.raw_col_name].values
-        self.df["target"] = self.df_raw[self.raw_col_target].values
+        # compound metadata is kept as plain strings once it leaves the reader
+        self.df["target"] = np.asarray(self.df_raw[self.raw_col_target], dtype=object)
 
         if "MoA" in self.df_raw.columns:
-            self.df["MoA"] = self.df_raw["MoA"]
+            self.df["MoA"] = np.asarray(self.df_raw["MoA"], dtype=object)
 
         if "R2" in self.df_raw.columns:
             self.df["R2"] = self.df_raw["R2"]
@@ -269,46 +434,7 @@ class DoseResponseCurve:
 
     def set_concentration_multipliers(self):
         """Set multipliers to turn concentrations into micromolars"""
-
-        # AC50 is in molar units
-        # concentration column is in micromolars
-        group_1 = [
-            "NTAP ipNF02.3 2l MIPE qHTS.csv",
-            "NTAP ipNF05.5 MC MIPE qHTS.csv",
-            "NTAP ipNF06.2A MIPE qHTS.csv",
-            "NTAP ipnNF95.11C MIPE qHTS.csv",
-            "NTAP ipNF02.8 MIPE qHTS.csv",
-            "NTAP ipNF95.11b C_T MIPE qHTS.csv",
-            "NTAP ipNF05.5 SC MIPE qHTS.csv",
-            "NTAP ipNF95.6 MIPE qHTS.csv",
-            "s-ntap-HFF-1.csv",
-            "s-ntap-MTC-1.csv",
-        ]
-
-        # AC50 is in micromolars
-        # concentration is in molar units
-        group_2 = [
-            "NTAP_ipNF95.11bC_MIPE_qHTS.csv",
-            "s-ntap-IPNF95_11b_P53-1",
-            "s-ntap-HFF-1",
-            "s-ntap-IPNF06_2A_P27-1",
-            "s-ntap-IPNF95-1bc-1",
-            "s-ntap-1PNO-1",
-            "s-ntap-IPNF95_6_P53-1",
-            "s-ntap-IPNF05_5_P30-1",
-            "s-ntap-IPNF05_5_P31-1",
-            "s-ntap-ipn02.8-1",
-            "s-ntap-ipnNF95_11C_P31-1",
-        ]
-
-        if self.smm_hts["name"] in group_1:
-            self.ac50_mult = 1e6
-            self.c_mult = 1.0
-        elif self.smm_hts["name"] in group_2:
-            self.ac50_mult = 1.0
-            self.c_mult = 1e6
-        else:
-            raise ValueError()
+        self.ac50_mult, self.c_mult = get_file_units(self.smm_hts["name"])
 
     def get_non_rc_cols(self):
         return [col for col in self.df.columns if col not in C_COLS + R_COLS]
@@ -317,14 +443,16 @@ class DoseResponseCurve:
         return ["NCGC SID", "name", "target", "SMILES"]
 
 
-def read_metadata(data_path):
+def read_metadata(data_path, use_cache=True):
     # data manifest for all files
     # might only be present when syncing with python client
     # this is the main metadata file we use
-    df_files = pd.read_csv(
-        data_path / "SYNAPSE_METADATA_MANIFEST.tsv",
-        sep="\t",
-    )
+    data_path = Path(data_path)
+    manifest_path = data_path / "SYNAPSE_METADATA_MANIFEST.tsv"
+    if use_cache:
+        df_files = cached_read_csv(manifest_path, data_path / CACHE_DIR_NAME, sep="\t")
+    else:
+        df_files = pd.read_csv(manifest_path, sep="\t")
 
     # only keep file descriptions for cell line dose response curves
     df_files = df_files[
@@ -410,17 +538,76 @@ def read_metadata(data_path):
     return df_files, df_clines, file_name_to_specimen_id
 
 
-def read_raw_drc(df_files, data_path):
-    """Read all dose response curve files"""
+def get_drc_file_path(data_path, file_name):
+    """Location of a dose response curve file inside the synapse dataset"""
+    if file_name.endswith("csv"):
+        path_suffix = Path(file_name)
+    else:
+        path_suffix = Path("matrix portal raw data") / file_name
+    return Path(data_path) / path_suffix
+
+
+def read_drc_file(file_path, cache_dir=None):
+    """Read one dose response curve file, returns the dataframe and the
+    number of seconds it took to read"""
+    start = time.perf_counter()
+    # the header decides the schema, only the columns it maps are parsed
+    columns = tuple(pd.read_csv(file_path, nrows=0).columns)
+    schema = resolve_drc_schema(columns)
+    kwargs = {"usecols": schema.usecols, "dtype": schema.dtypes}
+    if cache_dir is not None:
+        df = cached_read_csv(file_path, cache_dir, **kwargs)
+    else:
+        df = pd.read_csv(file_path, **kwargs)
+    return df, time.perf_counter() - start
+
+
+def read_raw_drc(
+    df_files,
+    data_path,
+    use_cache=True,
+    max_workers=DEFAULT_READ_WORKERS,
+    use_processes=False,
+    timings=None,
+):
+    """Read all dose response curve files
+
+    Parsed files are stored in a columnar cache under the data path so that
+    later calls skip csv parsing. A cached file is rebuilt automatically when
+    its source file changes (size or modification time).
+
+    Files are read concurrently with a thread pool of ``max_workers``
+    workers (``max_workers=1`` reads them one after another). With
+    ``use_processes=True`` a process pool is used instead, which helps when
+    csv parsing rather than disk access is the bottleneck. If a ``timings``
+    dict is passed it is filled with the seconds spent on each file.
+    """
+    data_path = Path(data_path)
+    cache_dir = data_path / CACHE_DIR_NAME if use_cache else None
+    file_paths = {
+        file_name: get_drc_file_path(data_path, file_name)
+        for file_name in df_files.index
+    }
+
+    if max_workers == 1:
+        results = {
+            file_name: read_drc_file(file_path, cache_dir)
+            for file_name, file_path in file_paths.items()
+        }
+    else:
+        executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with executor_cls(max_workers=max_workers) as executor:
+            futures = {
+                file_name: executor.submit(read_drc_file, file_path, cache_dir)
+                for file_name, file_path in file_paths.items()
+            }
+            results = {file_name: future.result() for file_name, future in futures.items()}
+
     dfs = {}
-    for file_name, row in df_files.iterrows():
-        if file_name.endswith("csv"):
-            path_suffix = Path(file_name)
-        else:
-            path_suffix = Path("matrix portal raw data") / file_name
-        file_path = data_path / path_suffix
-        df = pd.read_csv(file_path)
+    for file_name, (df, seconds) in results.items():
         dfs[file_name] = df
+        if timings is not None:
+            timings[file_name] = seconds
     return dfs
 
 
@@ -440,6 +627,573 @@ def make_mrgd_drc(drcs, file_name_to_specimen_id):
     return dfs
 
 
+class DrcStore:
+    """Compound aligned dose response curves for all cell lines
+
+    Compound metadata is kept once in ``df_compounds``. Fit parameters are
+    float32 arrays of shape (n_lines, n_compounds) in ``params`` and the
+    measured curves are float32 arrays of shape (n_lines, n_compounds, 11)
+    in ``conc`` and ``resp``. Rows follow ``cell_lines`` and columns follow
+    ``df_compounds``, so comparing cell lines is an array slice. A saved
+    store can be loaded memory-mapped.
+    """
+
+    def __init__(self, df_compounds, cell_lines, params, conc, resp):
+        self.df_compounds = df_compounds
+        self.cell_lines = list(cell_lines)
+        self.params = params
+        self.conc = conc
+        self.resp = resp
+        self.line_index = {si: ii for ii, si in enumerate(self.cell_lines)}
+        self.sid_index = {sid: ii for ii, sid in enumerate(df_compounds["NCGC SID"].values)}
+
+    @classmethod
+    def from_frames(cls, dfs_drc):
+        """Build a store from the per cell line dataframes of ``make_mrgd_drc``"""
+        cell_lines = list(dfs_drc.keys())
+        # all dose response curves have the same compounds so we just take one
+        df_first = dfs_drc[cell_lines[0]]
+        compound_cols = [col for col in COMPOUND_COLS if col in df_first.columns]
+        df_compounds = df_first[compound_cols].reset_index(drop=True)
+        ncgc_sids = df_compounds["NCGC SID"].values
+
+        n_lines, n_compounds = len(cell_lines), len(df_compounds)
+        params = {
+            col: np.full((n_lines, n_compounds), np.nan, dtype=np.float32)
+            for col in DRC_PARAM_COLS
+        }
+        conc = np.empty((n_lines, n_compounds, len(C_COLS)), dtype=np.float32)
+        resp = np.empty((n_lines, n_compounds, len(R_COLS)), dtype=np.float32)
+        for ii, si in enumerate(cell_lines):
+            df = dfs_drc[si].set_index("NCGC SID").reindex(ncgc_sids)
+            for col in DRC_PARAM_COLS:
+                if col in df.columns:
+                    params[col][ii] = df[col].values
+            conc[ii] = df[C_COLS].values
+            resp[ii] = df[R_COLS].values
+
+        return cls(df_compounds, cell_lines, params, conc, resp)
+
+    def save(self, store_path, fingerprint=None):
+        """Write the store to a directory of .npy files"""
+        with atomic_directory(store_path) as tmp_path:
+            save_frame(self.df_compounds, tmp_path / "compounds", fingerprint)
+            for col, arr in self.params.items():
+                np.save(tmp_path / f"param_{col}.npy", arr)
+            np.save(tmp_path / "conc.npy", self.conc)
+            np.save(tmp_path / "resp.npy", self.resp)
+            with open(tmp_path / META_FILE_NAME, "w") as fp:
+                json.dump(
+                    {
+                        "fingerprint": fingerprint,
+                        "cell_lines": self.cell_lines,
+                        "params": list(self.params.keys()),
+                    },
+                    fp,
+                )
+
+    @classmethod
+    def load(cls, store_path, fingerprint=None, mmap_mode="r"):
+        """Load a saved store, returns None if it is missing or stale"""
+        store_path = Path(store_path)
+        meta_path = store_path / META_FILE_NAME
+        if not meta_path.exists():
+            return None
+        with open(meta_path) as fp:
+            meta = json.load(fp)
+        if fingerprint is not None and meta["fingerprint"] != fingerprint:
+            return None
+
+        df_compounds = load_frame(store_path / "compounds")
+        params = {
+            col: np.load(store_path / f"param_{col}.npy", mmap_mode=mmap_mode)
+            for col in meta["params"]
+        }
+        conc = np.load(store_path / "conc.npy", mmap_mode=mmap_mode)
+        resp = np.load(store_path / "resp.npy", mmap_mode=mmap_mode)
+        return cls(df_compounds, meta["cell_lines"], params, conc, resp)
+
+    def with_params(self, df_params):
+        """A new store with fit parameters replaced by a long format table
+        (e.g. from ``refit_drc_store``), measured points are shared"""
+        params = {col: np.array(arr) for col, arr in self.params.items()}
+        line_pos = df_params["cell_line"].map(self.line_index).values
+        sid_pos = df_params["NCGC SID"].map(self.sid_index).values
+        for col in DRC_PARAM_COLS:
+            if col in df_params.columns:
+                params[col][line_pos, sid_pos] = df_params[col].values
+        return DrcStore(self.df_compounds, self.cell_lines, params, self.conc, self.resp)
+
+    def param(self, col, sis=None):
+        """Fit parameter ``col`` for the cell lines ``sis`` (all by default)"""
+        if sis is None:
+            return self.params[col]
+        return self.params[col][[self.line_index[si] for si in sis]]
+
+    def compound(self, ncgc_sid, sis=None):
+        """Fit parameters and measured points of one compound in several cell lines
+
+        One O(1) lookup of the compound column, returns a dict with
+        "cell_line", one array of shape (n_sis,) per fit parameter plus "eff",
+        and "conc" / "resp" arrays of shape (n_sis, 11).
+        """
+        sis = self.cell_lines if sis is None else list(sis)
+        jj = self.sid_index[ncgc_sid]
+        lines = [self.line_index[si] for si in sis]
+        curves = {"cell_line": sis}
+        for col, arr in self.params.items():
+            curves[col] = np.asarray(arr[lines, jj], dtype=np.float64)
+        curves["eff"] = curves["ZERO"] - curves["INF"]
+        curves["conc"] = np.asarray(self.conc[lines, jj], dtype=np.float64)
+        curves["resp"] = np.asarray(self.resp[lines, jj], dtype=np.float64)
+        return curves
+
+    def scatter_frame(self, sis=None, min_r2=None):
+        """AC50 vs eff points of the cell lines ``sis`` (all by default)
+
+        Curves with R2 below ``min_r2`` are dropped with one vectorized mask
+        (a NaN R2 is kept).
+        Returns "NCGC SID", "compound", "target", "MoA", "cell line", "AC50",
+        "eff" and "R2", ordered by cell line and then by compound.
+        """
+        sis = self.cell_lines if sis is None else list(sis)
+        lines = [self.line_index[si] for si in sis]
+        r2 = np.asarray(self.params["R2"][lines])
+        # NaN R2 is not below min_r2, those curves are kept
+        mask = np.ones(r2.shape, dtype=bool) if min_r2 is None else ~(r2 < min_r2)
+        line_pos, compound_pos = np.nonzero(mask)
+
+        meta_cols = [col for col in ["NCGC SID", "name", "target", "MoA"] if col in self.df_compounds.columns]
+        df = self.df_compounds[meta_cols].iloc[compound_pos].reset_index(drop=True)
+        df = df.rename(columns={"name": "compound"})
+        df["cell line"] = np.asarray(sis, dtype=object)[line_pos]
+        params = {col: np.asarray(self.params[col][lines]) for col in ["AC50", "ZERO", "INF"]}
+        df["AC50"] = params["AC50"][mask]
+        df["eff"] = (params["ZERO"] - params["INF"])[mask]
+        df["R2"] = r2[mask]
+        return df
+
+    def long_frame(self, cols=None):
+        """Fit parameters of every cell line in one long format dataframe
+
+        Only ``cols`` (all fit parameters by default) are included, along
+        with "NCGC SID", "cell_line" and "eff".
+        """
+        cols = DRC_PARAM_COLS if cols is None else cols
+        n_lines, n_compounds = len(self.cell_lines), len(self.df_compounds)
+        df = pd.DataFrame(
+            {
+                "NCGC SID": np.tile(self.df_compounds["NCGC SID"].values, n_lines),
+                "cell_line": np.repeat(np.asarray(self.cell_lines, dtype=object), n_compounds),
+            }
+        )
+        for col in cols:
+            df[col] = self.params[col].reshape(-1)
+        df["eff"] = (self.params["ZERO"] - self.params["INF"]).reshape(-1)
+        return df
+
+
+def ll4(c, h, inf, zero, ec50):
+    """A copy of the LL.4 function from the R drc package with,
+    https://doseresponse.github.io/drc/reference/LL.4.html
+
+     - c: concentration
+     - h: hill slope
+     - inf: asymptote at max concentration
+     - zero: asymptote at zero concentration
+     - ec50: EC50
+    """
+    num = zero - inf
+    den = 1 + np.exp(h * (np.log(c) - np.log(ec50)))
+    response = inf + num / den
+    return response
+
+
+def _ll4_model(log_c, theta):
+    """LL.4 response and jacobian for a batch of curves
+
+    ``log_c`` has shape (n_curves, n_points) and ``theta`` has shape
+    (n_curves, 4) holding (hill, inf, zero, log ec50). Returns the response
+    (n_curves, n_points) and the jacobian (n_curves, n_points, 4).
+    """
+    h, inf, zero, log_ec50 = (theta[:, ii, None] for ii in range(4))
+    dx = log_c - log_ec50
+    u = np.exp(np.clip(h * dx, -50.0, 50.0))
+    g = 1.0 / (1.0 + u)
+    span = zero - inf
+    response = inf + span * g
+
+    jac = np.empty(log_c.shape + (4,))
+    dg = -span * u * g * g
+    jac[..., 0] = dg * dx
+    jac[..., 1] = 1.0 - g
+    jac[..., 2] = g
+    jac[..., 3] = -dg * h
+    return response, jac
+
+
+def _ll4_initial_guess(log_c, resp, weights):
+    """Data driven starting values (hill, inf, zero, log ec50)"""
+    n_curves = log_c.shape[0]
+    order = np.argsort(np.where(weights > 0, log_c, np.inf), axis=1)
+    resp_sorted = np.take_along_axis(resp, order, axis=1)
+    log_c_sorted = np.take_along_axis(log_c, order, axis=1)
+    n_valid = weights.sum(axis=1).astype(int)
+    last = np.maximum(n_valid - 1, 0)
+
+    rows = np.arange(n_curves)
+    zero = resp_sorted[:, 0]
+    inf = resp_sorted[rows, last]
+    mid = 0.5 * (zero + inf)
+    # concentration with the response closest to the half way point
+    dist = np.where(weights[rows[:, None], order] > 0, np.abs(resp_sorted - mid[:, None]), np.inf)
+    log_ec50 = log_c_sorted[rows, np.argmin(dist, axis=1)]
+
+    theta = np.stack([np.ones(n_curves), inf, zero, log_ec50], axis=1)
+    return np.nan_to_num(theta)
+
+
+def fit_ll4(conc, resp, max_iter=LL4_MAX_ITER, damping=LL4_INIT_DAMPING):
+    """Fit LL.4 curves to many dose response curves at once
+
+    ``conc`` and ``resp`` have shape (n_curves, n_points). All curves are
+    fitted together with batched Levenberg-Marquardt iterations, NaN points
+    are ignored. Returns a dict of arrays of shape (n_curves,) with the
+    columns "HILL", "INF", "ZERO", "AC50", "LAC50" and "R2".
+    """
+    conc = np.asarray(conc, dtype=np.float64)
+    resp = np.asarray(resp, dtype=np.float64)
+    weights = (np.isfinite(conc) & np.isfinite(resp) & (conc > 0)).astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_c = np.where(weights > 0, np.log(conc), 0.0)
+    resp = np.where(weights > 0, resp, 0.0)
+
+    theta = _ll4_initial_guess(log_c, resp, weights)
+    lam = np.full(len(theta), damping)
+
+    # keep the hill slope and the AC50 within a few decades of the tested range
+    log_c_min = np.where(weights > 0, log_c, np.inf).min(axis=1)
+    log_c_max = np.where(weights > 0, log_c, -np.inf).max(axis=1)
+    theta_min = np.stack(
+        [np.full(len(theta), -LL4_MAX_HILL), np.full(len(theta), -np.inf),
+         np.full(len(theta), -np.inf), log_c_min - LL4_LOG_AC50_MARGIN],
+        axis=1,
+    )
+    theta_max = np.stack(
+        [np.full(len(theta), LL4_MAX_HILL), np.full(len(theta), np.inf),
+         np.full(len(theta), np.inf), log_c_max + LL4_LOG_AC50_MARGIN],
+        axis=1,
+    )
+    theta = np.clip(theta, theta_min, theta_max)
+    eye = np.eye(4)
+
+    def sse(theta):
+        response, jac = _ll4_model(log_c, theta)
+        resid = weights * (resp - response)
+        return (resid ** 2).sum(axis=1), resid, jac
+
+    cost, resid, jac = sse(theta)
+    active = np.ones(len(theta), dtype=bool)
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        jac_w = jac * weights[..., None]
+        jtj = np.einsum("npi,npj->nij", jac_w, jac_w)
+        jtr = np.einsum("npi,np->ni", jac_w, resid)
+        diag = np.einsum("nii->ni", jtj)
+        lhs = jtj + lam[:, None, None] * (diag[:, :, None] * eye + 1e-12 * eye)
+        # pseudo-inverse so that degenerate (e.g. flat) curves do not fail the batch
+        step = (np.linalg.pinv(lhs) @ jtr[..., None])[..., 0]
+        step = np.where(active[:, None] & np.isfinite(step), step, 0.0)
+
+        new_theta = np.clip(theta + step, theta_min, theta_max)
+        new_cost, new_resid, new_jac = sse(new_theta)
+        improved = active & (new_cost < cost)
+
+        theta = np.where(improved[:, None], new_theta, theta)
+        resid = np.where(improved[:, None], new_resid, resid)
+        jac = np.where(improved[:, None, None], new_jac, jac)
+        converged = improved & ((cost - new_cost) <= 1e-10 * (1.0 + cost))
+        cost = np.where(improved, new_cost, cost)
+        lam = np.where(improved, lam / 10.0, lam * 10.0)
+        active &= ~converged & (lam < 1e12)
+
+    # (h, inf, zero) and (-h, zero, inf) are the same curve, keep h >= 0 so
+    # that INF is the asymptote at max concentration and eff = ZERO - INF
+    mirrored = theta[:, 0] < 0
+    theta[mirrored] = theta[mirrored][:, [0, 2, 1, 3]] * np.array([-1.0, 1.0, 1.0, 1.0])
+
+    n_valid = weights.sum(axis=1)
+    mean = (weights * resp).sum(axis=1) / np.maximum(n_valid, 1)
+    sst = (weights * (resp - mean[:, None]) ** 2).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r2 = 1.0 - cost / sst
+
+    ac50 = np.exp(theta[:, 3])
+    fit = {
+        "HILL": theta[:, 0],
+        "INF": theta[:, 1],
+        "ZERO": theta[:, 2],
+        "AC50": ac50,
+        "LAC50": np.log10(ac50),
+        "R2": r2,
+    }
+    # curves without enough points to fit 4 parameters
+    for col in fit:
+        fit[col] = np.where(n_valid >= 4, fit[col], np.nan)
+    return fit
+
+
+def _fit_ll4_cell_line(conc, resp, max_iter):
+    return fit_ll4(conc, resp, max_iter=max_iter)
+
+
+def refit_drc_store(drc_store, max_workers=None, use_processes=True, max_iter=LL4_MAX_ITER):
+    """Refit LL.4 to the measured points of every compound and cell line
+
+    Each cell line is fitted as one batch, cell lines are distributed over a
+    process pool (or a thread pool with ``use_processes=False``). Returns a
+    long format table with "cell_line", "NCGC SID" and the refit parameters
+    that can be swapped in with ``DrcStore.with_params``.
+    """
+    executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_cls(max_workers=max_workers) as executor:
+        futures = {
+            si: executor.submit(
+                _fit_ll4_cell_line,
+                np.asarray(drc_store.conc[ii]),
+                np.asarray(drc_store.resp[ii]),
+                max_iter,
+            )
+            for si, ii in drc_store.line_index.items()
+        }
+        fits = {si: future.result() for si, future in futures.items()}
+
+    dfs = []
+    for si, fit in fits.items():
+        df = pd.DataFrame({"cell_line": si, "NCGC SID": drc_store.df_compounds["NCGC SID"].values})
+        for col in DRC_PARAM_COLS:
+            df[col] = fit[col].astype(np.float32)
+        dfs.append(df)
+    return pd.concat(dfs, ignore_index=True)
+
+
+def get_dataset_fingerprint(data_path):
+    """Cheap (stat only) fingerprint of the manifest and every file in
+    FILE_NAME_GROUPS, as a hashable tuple of (name, size, mtime)"""
+    data_path = Path(data_path)
+    file_paths = [data_path / "SYNAPSE_METADATA_MANIFEST.tsv"] + [
+        get_drc_file_path(data_path, file_name)
+        for file_name in funcy.flatten(FILE_NAME_GROUPS)
+    ]
+    fingerprint = []
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+            fingerprint.append((file_path.name, stat.st_size, stat.st_mtime_ns))
+        except FileNotFoundError:
+            fingerprint.append((file_path.name, None, None))
+    return tuple(fingerprint)
+
+
+def get_drc_fingerprint(df_files, data_path):
+    """Fingerprint of the manifest, every dose response curve file and the store version"""
+    data_path = Path(data_path)
+    fingerprint = {"manifest": file_fingerprint(data_path / "SYNAPSE_METADATA_MANIFEST.tsv")}
+    for file_name in df_files.index:
+        fingerprint[file_name] = file_fingerprint(get_drc_file_path(data_path, file_name))
+    fingerprint["version"] = DRC_STORE_VERSION
+    return fingerprint
+
+
+def build_drc_store(df_files, data_path, file_name_to_specimen_id, **kwargs):
+    """Read, merge and stack all dose response curve files into a DrcStore"""
+    file_show_cols = [col for col in df_files.columns if col not in FILE_HIDE_COLS]
+
+    # raw dose-response curve dataframes
+    dfs_drc_raw = read_raw_drc(df_files, data_path, **kwargs)
+
+    # create dose-response curve objects
+    drcs = {}
+    for file_name, df_drc_raw in dfs_drc_raw.items():
+        file_row = df_files.loc[file_name][file_show_cols]
+        drcs[file_name] = DoseResponseCurve(file_row.to_dict(), df_drc_raw)
+
+    dfs_drc = make_mrgd_drc(drcs, file_name_to_specimen_id)
+    return DrcStore.from_frames(dfs_drc)
+
+
+def load_drc_store(df_files, data_path, file_name_to_specimen_id, mmap_mode="r", **kwargs):
+    """Load the DrcStore from the cache directory, rebuilding it if any
+    source file changed. Extra keyword arguments go to ``read_raw_drc``."""
+    data_path = Path(data_path)
+    store_path = data_path / CACHE_DIR_NAME / DRC_STORE_DIR_NAME
+    fingerprint = get_drc_fingerprint(df_files, data_path)
+
+    drc_store = DrcStore.load(store_path, fingerprint, mmap_mode=mmap_mode)
+    if drc_store is None:
+        build_drc_store(df_files, data_path, file_name_to_specimen_id, **kwargs).save(
+            store_path, fingerprint
+        )
+        drc_store = DrcStore.load(store_path, fingerprint, mmap_mode=mmap_mode)
+    return drc_store
+
+
+class MipeDataset:
+    """Everything derived from the files alone, ready to be shared read-only
+
+    - df_files, df_clines, file_name_to_specimen_id: see ``read_metadata``
+    - drc_store: memory-mapped ``DrcStore`` of all cell lines
+    - df_compounds: compound table (one row per NCGC SID)
+    - df_drc: long format fit parameters used by the distributions
+    - ratio_store: ``RatioStore`` with memoized ratio pairs
+    - fingerprint: ``get_dataset_fingerprint`` of the files it was built from
+    """
+
+    def __init__(self, data_path, **kwargs):
+        self.data_path = Path(data_path)
+        self.fingerprint = get_dataset_fingerprint(self.data_path)
+        self.df_files, self.df_clines, self.file_name_to_specimen_id = read_metadata(self.data_path)
+        self.drc_store = load_drc_store(
+            self.df_files, self.data_path, self.file_name_to_specimen_id, **kwargs
+        )
+        self.df_compounds = self.drc_store.df_compounds
+        self.df_drc = self.drc_store.long_frame(["R2", "LAC50"])
+        self.ratio_store = RatioStore(self.drc_store)
+
+
+# fit parameters stacked into (cell line x compound) arrays by the ratio engine
+FIT_PARAM_COLS = ["AC50", "ZERO", "INF", "R2"]
+
+# row position of a compound in ``df_compounds``, the key of the ratios table
+COMPOUND_ID_COL = "compound_id"
+
+# column order of the long format ratios table (after the compound id)
+RATIO_COLS = [
+    "num_si",
+    "den_si",
+    "num_R2",
+    "den_R2",
+    "num_AC50",
+    "den_AC50",
+    "AC50 ratio",
+    "Log10 (AC50 ratio)",
+    "num_eff",
+    "den_eff",
+    "eff ratio",
+    "score",
+    "Log10 score",
+    "s_prime_num",
+    "s_prime_den",
+    "delta_s_prime",
+]
+
+
+def stack_fit_params(dfs_drc, ncgc_sids, cell_lines):
+    """Stack fit parameters into arrays of shape (n_cell_lines, n_compounds)
+
+    Rows follow ``cell_lines`` and columns follow ``ncgc_sids``. Each cell
+    line is aligned on "NCGC SID", compounds missing from a cell line are NaN.
+    """
+    params = {col: np.empty((len(cell_lines), len(ncgc_sids))) for col in FIT_PARAM_COLS}
+    for ii, si in enumerate(cell_lines):
+        df = dfs_drc[si].set_index("NCGC SID").reindex(ncgc_sids)
+        for col in FIT_PARAM_COLS:
+            params[col][ii] = df[col].values
+    return params
+
+
+def calculate_line_arrays(params):
+    """Derived arrays that depend on a single cell line
+
+    - eff: effectiveness, ZERO - INF
+    - s_prime: asinh of the working ratio (INF - ZERO) / AC50
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        eff = params["ZERO"] - params["INF"]
+        s_prime = np.arcsinh((params["INF"] - params["ZERO"]) / params["AC50"])
+    return {
+        "R2": params["R2"],
+        "AC50": params["AC50"],
+        "eff": eff,
+        "s_prime": s_prime,
+    }
+
+
+def compute_ratio_tensors(num_arrays, den_arrays):
+    """Compute all pair metrics at once by broadcasting
+
+    ``num_arrays`` and ``den_arrays`` are outputs of ``calculate_line_arrays``
+    with shapes (n_num, n_compounds) and (n_den, n_compounds). Every returned
+    tensor has shape (n_num, n_den, n_compounds).
+    """
+    def num(arr):
+        return arr[:, None, :]
+
+    def den(arr):
+        return arr[None, :, :]
+
+    shape = (num_arrays["AC50"].shape[0],) + den_arrays["AC50"].shape
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ac50_ratio = num(num_arrays["AC50"]) / den(den_arrays["AC50"])
+        eff_ratio = num(num_arrays["eff"]) / den(den_arrays["eff"])
+        # score = (num_eff/den_eff) / (num_AC50/den_AC50)
+        # Swapped direction of ratio to fix integer
+        score = ac50_ratio / eff_ratio
+        tensors = {
+            "num_R2": num(num_arrays["R2"]),
+            "den_R2": den(den_arrays["R2"]),
+            "num_AC50": num(num_arrays["AC50"]),
+            "den_AC50": den(den_arrays["AC50"]),
+            "AC50 ratio": ac50_ratio,
+            "Log10 (AC50 ratio)": np.log10(ac50_ratio),
+            "num_eff": num(num_arrays["eff"]),
+            "den_eff": den(den_arrays["eff"]),
+            "eff ratio": eff_ratio,
+            "score": score,
+            "Log10 score": np.log10(score),
+            "s_prime_num": num(num_arrays["s_prime"]),
+            "s_prime_den": den(den_arrays["s_prime"]),
+            "delta_s_prime": num(num_arrays["s_prime"]) - den(den_arrays["s_prime"]),
+        }
+    return {col: np.broadcast_to(arr, shape) for col, arr in tensors.items()}
+
+
+def ratio_tensors_to_frame(df_compounds, tensors, num_sis, den_sis):
+    """Flatten (num x den x compound) tensors into the long format table
+
+    The table only holds compact columns: the compound id (row position in
+    ``df_compounds``), categorical num_si / den_si and float32 metrics. Use
+    ``join_compound_meta`` to add the compound columns for display.
+    """
+    n_num, n_den, n_compounds = len(num_sis), len(den_sis), len(df_compounds)
+
+    data = {
+        COMPOUND_ID_COL: np.tile(np.arange(n_compounds, dtype=np.int32), n_num * n_den),
+        "num_si": pd.Categorical.from_codes(
+            np.repeat(np.arange(n_num), n_den * n_compounds), categories=num_sis
+        ),
+        "den_si": pd.Categorical.from_codes(
+            np.tile(np.repeat(np.arange(n_den), n_compounds), n_num), categories=den_sis
+        ),
+    }
+    for col in RATIO_COLS[2:]:
+        data[col] = tensors[col].reshape(-1).astype(np.float32)
+    return pd.DataFrame(data)
+
+
+def join_compound_meta(df_ratios, df_compounds, columns=COMPOUND_COLS):
+    """Ratios table with the compound columns in front of the ratio columns
+
+    Meant for display and export only, the strings are repeated for every
+    (num_si, den_si) pair.
+    """
+    columns = [col for col in columns if col in df_compounds.columns]
+    df_meta = df_compounds[columns].iloc[df_ratios[COMPOUND_ID_COL].to_numpy()]
+    df_meta = df_meta.set_axis(df_ratios.index)
+    return pd.concat([df_meta, df_ratios.drop(columns=COMPOUND_ID_COL)], axis=1)
+
+
 def calculate_fit_ratios(df_compounds, dfs_drc_in, den_sis, num_sis):
     """
     Parameters:
@@ -456,118 +1210,360 @@ def calculate_fit_ratios(df_compounds, dfs_drc_in, den_sis, num_sis):
     but this list is dynamically filterable by the user.
 
     The numerator list includes all the experimental cell lines to use.
+
+    Fit parameters are stacked into (cell line x compound) arrays and every
+    (num_si, den_si) pair is computed in one broadcast over a
+    (num x den x compound) tensor. The long format table is only built at the end,
+    keyed by compound id (see ``ratio_tensors_to_frame``).
     """
-    dfs_drc = {si: df.set_index("NCGC SID") for si, df in dfs_drc_in.items()}
-
-    df_ratios = pd.DataFrame()
-
-    # numerator cell lines represent the reference cell lines, only one reference is used at a time
-    for num_si in num_sis:
-        # denominator cell lines represent the test cell lines
-        for den_si in den_sis:
-            df = df_compounds.copy().set_index("NCGC SID")
-            df["num_si"] = num_si
-            df["den_si"] = den_si
-            df["num_R2"] = dfs_drc[num_si]["R2"]
-            df["den_R2"] = dfs_drc[den_si]["R2"]
-
-            num_ac50 = dfs_drc[num_si]["AC50"]
-            den_ac50 = dfs_drc[den_si]["AC50"]
-            df["num_AC50"] = num_ac50
-            df["den_AC50"] = den_ac50
-            df["AC50 ratio"] = num_ac50 / den_ac50
-            df["Log10 (AC50 ratio)"] = np.log10(df["AC50 ratio"])
-
-            num_eff = dfs_drc[num_si]["ZERO"] - dfs_drc[num_si]["INF"]
-            den_eff = dfs_drc[den_si]["ZERO"] - dfs_drc[den_si]["INF"]
-            df["num_eff"] = num_eff
-            df["den_eff"] = den_eff
-            df["eff ratio"] = num_eff / den_eff
-
-            # score = (num_eff/den_eff) / (num_AC50/den_AC50)
-            # Swapped direction of ratio to fix integer
-            df["score"] = df["AC50 ratio"] / df["eff ratio"]
-            df["Log10 score"] = np.log10(df["score"])
-            # define s_prime for numerator and denominator
-            # for the numerator, define (A-D)/C, the working ratio, where
-            #   A is dfs_drc[num_si]["INF"],
-            #   D is dfs_drc[num_si]["ZERO"]
-            #   C is dfs_drc[num_si]["AC50"]
-            working_ratio_num = (
-                dfs_drc[num_si]["INF"] - dfs_drc[num_si]["ZERO"]
-            ) / dfs_drc[num_si]["AC50"]            
-            df["s_prime_num"] = np.arcsinh(working_ratio_num)            
-
-            # for the denominator, define (A-D)/C, the working ratio using den_si
-            working_ratio_den = (
-                dfs_drc[den_si]["INF"] - dfs_drc[den_si]["ZERO"]
-            ) / dfs_drc[den_si]["AC50"]
-            # take the natural log of the sum of the working ratio and the square root of the sum of the working ratio squared and 1
-            df["s_prime_den"] = np.arcsinh(working_ratio_den)
-            
-            df["delta_s_prime"] = df["s_prime_num"] - df["s_prime_den"]
-
-            df_ratios = pd.concat([df_ratios, df])
-
-    df_ratios = df_ratios.reset_index()
-    return df_ratios
+    num_sis, den_sis = list(num_sis), list(den_sis)
+    ncgc_sids = df_compounds["NCGC SID"].values
 
+    num_arrays = calculate_line_arrays(stack_fit_params(dfs_drc_in, ncgc_sids, num_sis))
+    den_arrays = calculate_line_arrays(stack_fit_params(dfs_drc_in, ncgc_sids, den_sis))
+    tensors = compute_ratio_tensors(num_arrays, den_arrays)
 
-if __name__ == "__main__":
+    return ratio_tensors_to_frame(df_compounds, tensors, num_sis, den_sis)
 
-    data_path = Path(dir_path, "data/syn5522627")
-    df_files, df_clines, file_name_to_specimen_id = read_metadata(data_path)
-    file_show_cols = [col for col in df_files.columns if col not in FILE_HIDE_COLS]
 
-    # raw dose-response curve dataframes
-    dfs_drc_raw = read_raw_drc(df_files)
+class RatioStore:
+    """Memoized ratio metrics for (num_si, den_si) pairs
 
-    # create dose-response curve objects
-    drcs = {}
-    for file_name, df_drc_raw in dfs_drc_raw.items():
-        file_row = df_files.loc[file_name][file_show_cols]
-        drc = DoseResponseCurve(file_row.to_dict(), df_drc_raw)
-        drcs[file_name] = drc
+    Per cell line arrays (R2, AC50, eff, S') are derived once per line from a
+    ``DrcStore`` and every pair is computed at most once. Changing the
+    selected cell lines only computes the pairs that are new, pairs that are
+    no longer selected are left out of the returned table but stay cached for
+    later toggles. One store can be shared by concurrent sessions, updates
+    are serialized by a lock.
+    """
+
+    def __init__(self, drc_store):
+        self.drc_store = drc_store
+        self.df_compounds = drc_store.df_compounds
+        self.ncgc_sids = self.df_compounds["NCGC SID"].values
+        self._line_arrays = {}
+        self._pairs = {}
+        self._lock = threading.Lock()
+
+    def line_arrays(self, si):
+        """Derived arrays of a single cell line, each of shape (n_compounds,)"""
+        if si not in self._line_arrays:
+            params = {
+                col: self.drc_store.param(col, [si]).astype(np.float64)
+                for col in FIT_PARAM_COLS
+            }
+            arrays = calculate_line_arrays(params)
+            self._line_arrays[si] = {col: arr[0] for col, arr in arrays.items()}
+        return self._line_arrays[si]
+
+    def stack_line_arrays(self, sis):
+        """Derived arrays of several cell lines, each of shape (n_lines, n_compounds)"""
+        arrays = [self.line_arrays(si) for si in sis]
+        return {
+            col: np.stack([arr[col] for arr in arrays]).reshape(len(sis), len(self.ncgc_sids))
+            for col in ["R2", "AC50", "eff", "s_prime"]
+        }
+
+    def update(self, num_sis, den_sis):
+        """Compute the pairs that are not cached yet"""
+        with self._lock:
+            self._update(num_sis, den_sis)
+
+    def _update(self, num_sis, den_sis):
+        missing = [
+            (num_si, den_si)
+            for num_si in num_sis
+            for den_si in den_sis
+            if (num_si, den_si) not in self._pairs
+        ]
+        if not missing:
+            return
+
+        new_nums = list(dict.fromkeys(num_si for num_si, _ in missing))
+        new_dens = list(dict.fromkeys(den_si for _, den_si in missing))
+        tensors = compute_ratio_tensors(
+            self.stack_line_arrays(new_nums),
+            self.stack_line_arrays(new_dens),
+        )
+        for ii, num_si in enumerate(new_nums):
+            for jj, den_si in enumerate(new_dens):
+                self._pairs[(num_si, den_si)] = {
+                    col: np.ascontiguousarray(arr[ii, jj]) for col, arr in tensors.items()
+                }
+
+    def tensors(self, num_sis, den_sis):
+        """Ratio metrics as (num x den x compound) tensors"""
+        num_sis, den_sis = list(num_sis), list(den_sis)
+        self.update(num_sis, den_sis)
+        shape = (len(num_sis), len(den_sis), len(self.ncgc_sids))
+        tensors = {}
+        for col in RATIO_COLS[2:]:
+            arrs = [self._pairs[(num_si, den_si)][col] for num_si in num_sis for den_si in den_sis]
+            tensors[col] = np.stack(arrs).reshape(shape) if arrs else np.empty(shape)
+        return tensors
+
+    def ratios(self, num_sis, den_sis):
+        """Long format ratios table, same layout as ``calculate_fit_ratios``"""
+        num_sis, den_sis = list(num_sis), list(den_sis)
+        tensors = self.tensors(num_sis, den_sis)
+        return ratio_tensors_to_frame(self.df_compounds, tensors, num_sis, den_sis)
+
+
+def _bootstrap_means(values, valid, n_boot, seed):
+    """Means over axis 0 of ``values`` for ``n_boot`` resamples of its rows"""
+    rng = np.random.default_rng(seed)
+    n_rows = values.shape[0]
+    # resampling rows with replacement is the same as multinomial row weights
+    weights = rng.multinomial(n_rows, np.full(n_rows, 1.0 / n_rows), size=n_boot)
+    weights = weights.astype(np.float64)
+    total = np.einsum("bn,n...->b...", weights, np.where(valid, values, 0.0))
+    count = np.einsum("bn,n...->b...", weights, valid.astype(np.float64))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (total / count).astype(np.float32)
+
+
+def bootstrap_mean_ci(values, valid=None, n_boot=1000, ci=0.95, seed=0, max_workers=None):
+    """Bootstrap confidence interval of the mean over axis 0
+
+    ``values`` has shape (n_samples, ...) e.g. the (num x den x compound)
+    delta S' tensor, where the test cell lines are resampled. Entries where
+    ``valid`` is False are left out of each mean. Resamples are drawn in
+    chunks with seeds spawned from ``seed``, so the result does not depend
+    on whether the chunks run in a process pool (``n_boot`` above
+    ``BOOTSTRAP_PROCESS_MIN``) or in this process.
+    Returns the lower and upper bounds with shape ``values.shape[1:]``.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if valid is None:
+        valid = np.isfinite(values)
+    valid = valid & np.isfinite(values)
+
+    chunk_sizes = [BOOTSTRAP_CHUNK_SIZE] * (n_boot // BOOTSTRAP_CHUNK_SIZE)
+    if n_boot % BOOTSTRAP_CHUNK_SIZE:
+        chunk_sizes.append(n_boot % BOOTSTRAP_CHUNK_SIZE)
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+
+    if n_boot >= BOOTSTRAP_PROCESS_MIN:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_bootstrap_means, values, valid, size, chunk_seed)
+                for size, chunk_seed in zip(chunk_sizes, seeds)
+            ]
+            means = [future.result() for future in futures]
+    else:
+        means = [
+            _bootstrap_means(values, valid, size, chunk_seed)
+            for size, chunk_seed in zip(chunk_sizes, seeds)
+        ]
+
+    means = np.concatenate(means)
+    alpha = (1.0 - ci) / 2.0
+    with warnings.catch_warnings():
+        # compounds without any valid pair give all-NaN slices
+        warnings.simplefilter("ignore", RuntimeWarning)
+        low, high = np.nanquantile(means, [alpha, 1.0 - alpha], axis=0)
+    return low, high
 
-    dfs_drc = make_mrgd_drc(drcs, file_name_to_specimen_id)
 
-    # make one dataframe
-    df_drc = pd.DataFrame()
-    for si, df1 in dfs_drc.items():
-        df1["cell_line"] = si
-        df_drc = pd.concat([df_drc, df1])
-    df_drc["eff"] = df_drc["ZERO"] - df_drc["INF"]
-
-    # all dose response curves have the same compounds so we just take one
-    one_specimen_id = next(iter(dfs_drc.keys()))
-    df_compounds = dfs_drc[one_specimen_id]
-    df_compounds = df_compounds[["NCGC SID", "name", "target", "MoA", "SMILES"]]
-
-    df_ratios = calculate_fit_ratios(df_compounds, dfs_drc, den_sis, num_sis)
-
-    st_th_r2 = 0.85
-    df_plt_ratios = df_ratios[
-        (df_ratios["num_R2"] >= st_th_r2)
-        & (df_ratios["den_R2"] >= st_th_r2)
-        & (df_ratios["num_eff"] > 0)
-        & (df_ratios["den_eff"] > 0)
+def calculate_delta_s_prime_ci(
+    ratio_store, num_sis, den_sis, min_r2, n_boot=1000, ci=0.95, seed=0, max_workers=None
+):
+    """Bootstrap CIs of the mean delta S' over test lines, per reference line
+
+    Pairs are only used where both cell lines pass ``min_r2``, the same
+    filter as the delta S' ranking. Returns a table with "den_si",
+    "NCGC SID", "delta_S_prime CI low" and "delta_S_prime CI high".
+    """
+    num_sis, den_sis = list(num_sis), list(den_sis)
+    tensors = ratio_store.tensors(num_sis, den_sis)
+    valid = (tensors["num_R2"] >= min_r2) & (tensors["den_R2"] >= min_r2)
+    low, high = bootstrap_mean_ci(
+        tensors["delta_s_prime"], valid, n_boot=n_boot, ci=ci, seed=seed, max_workers=max_workers
+    )
+
+    n_compounds = len(ratio_store.ncgc_sids)
+    return pd.DataFrame(
+        {
+            "den_si": np.repeat(np.asarray(den_sis, dtype=object), n_compounds),
+            "NCGC SID": np.tile(ratio_store.ncgc_sids, len(den_sis)),
+            "delta_S_prime CI low": low.reshape(-1),
+            "delta_S_prime CI high": high.reshape(-1),
+        }
+    )
+
+
+# Rankings
+# ==================================
+
+# ranked metric -> (value column, mean column, variance column, values list column)
+RANKING_COLUMN_NAMES = {
+    "Log10 (AC50 ratio)": (
+        "Log10 (AC50 ratio)",
+        "mean Log10 AC50 ratios",
+        "variance Log10 AC50 ratios",
+        "Log10 AC50 ratios",
+    ),
+    "Log10 score": (
+        "Log10 score",
+        "mean delta_S",
+        "variance delta_S",
+        "delta_S Scores (Log10)",
+    ),
+    "delta_s_prime": (
+        "Delta S_prime",
+        "mean delta_S_prime",
+        "variance delta_S_prime",
+        "delta_S_prime values",
+    ),
+}
+
+
+def filter_ratios_by_r2(df_ratios, min_r2):
+    """Keep pairs where both cell lines have a fit with R2 >= min_r2"""
+    return df_ratios[
+        (df_ratios["num_R2"] >= min_r2)
+        & (df_ratios["den_R2"] >= min_r2)
     ]
 
-    st_th_ac50_ratio = 1.5
-    st_th_lac50_ratio = np.log10(st_th_ac50_ratio)
-    df_good_ratios = df_plt_ratios[
-        df_plt_ratios["Log10 (AC50 ratio)"] > st_th_lac50_ratio
+
+def rank_compounds(df_ratios, df_compounds, metric, den_sis, num_sis, min_num_clines):
+    """Rank compounds by the mean of ``metric`` over the test cell lines
+
+    One engine for every ranked metric (see ``RANKING_COLUMN_NAMES``). The
+    ratios are pivoted once into one column per test line, then the number of
+    test lines, mean, variance and list of values are computed row-wise.
+    Returns a dict of reference cell line -> ranked table indexed by
+    "NCGC SID", sorted by decreasing mean and keeping compounds measured in at
+    least ``min_num_clines`` test lines.
+    """
+    _, mean_col, var_col, list_col = RANKING_COLUMN_NAMES[metric]
+
+    df = df_ratios[df_ratios["den_si"].isin(den_sis) & df_ratios["num_si"].isin(num_sis)]
+    values = pd.Series(
+        df[metric].to_numpy(dtype=np.float64),
+        index=pd.MultiIndex.from_arrays(
+            [df["den_si"].astype(object), df[COMPOUND_ID_COL], df["num_si"].astype(object)],
+            names=["den_si", COMPOUND_ID_COL, "num_si"],
+        ),
+    )
+
+    # (den_si, compound id) x num_si, a pair is present even if its value is NaN
+    df_wide = values.unstack("num_si")
+    present = pd.Series(True, index=values.index).unstack("num_si", fill_value=False)
+    num_cols = [num_si for num_si in num_sis if num_si in df_wide.columns]
+    df_wide, present = df_wide[num_cols], present[num_cols]
+
+    # values are listed in alphabetical order of the test lines
+    sorted_cols = sorted(num_cols)
+    wide_values = df_wide[sorted_cols].to_numpy(dtype=np.float64)
+    wide_present = present[sorted_cols].to_numpy()
+    value_lists = [
+        [f"{el:.3f}" for el, is_present in zip(row_values, row_present) if is_present]
+        for row_values, row_present in zip(wide_values, wide_present)
     ]
 
-    df_ranked = (
-        df_good_ratios.groupby(["den_si", "NCGC SID"])["score"]
-        .agg(["size", "mean", lambda x: list(x)])
-        .reset_index()
+    df_ranked = pd.DataFrame(
+        {
+            "N Cell Lines": present.sum(axis=1),
+            mean_col: df_wide.mean(axis=1),
+            var_col: df_wide.var(axis=1),
+            list_col: value_lists,
+        },
+        index=df_wide.index,
     )
-    st_th_num_clines = 3
-    df_ranked = df_ranked[df_ranked["size"] >= st_th_num_clines]
-    df_ranked = pd.merge(df_ranked, df_compounds, on="NCGC SID")
-    df_ranked = df_ranked.drop(columns="SMILES").sort_values(
-        ["size", "mean"],
-        ascending=[False, False],
+    df_ranked = df_ranked[df_ranked["N Cell Lines"] >= min_num_clines]
+
+    # metadata is joined once per ranked compound, not carried in the ratios
+    df_meta = df_compounds.drop(columns="SMILES", errors="ignore").reset_index(drop=True)
+    df_ranked = df_ranked.join(df_meta, on=COMPOUND_ID_COL).join(df_wide)
+    df_ranked = df_ranked.reset_index(level="den_si").set_index("NCGC SID")
+    df_ranked = df_ranked.sort_values([mean_col], ascending=[False])
+
+    return {
+        den_si: df_ranked[df_ranked["den_si"] == den_si]
+        for den_si in den_sis
+    }
+
+
+# Command line
+# ==================================
+
+def write_table(df, path, file_format):
+    if file_format == "parquet":
+        # the list column is stored as text to keep the table flat
+        df = flatten_list_columns(df)
+        df.to_parquet(path.parent / f"{path.name}.parquet")
+    else:
+        df.to_csv(path.parent / f"{path.name}.csv")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compute and export all syn5522627 compound rankings without streamlit",
+    )
+    parser.add_argument("--data-path", type=Path, default=Path(dir_path, "data/syn5522627"))
+    parser.add_argument("--out-dir", type=Path, default=Path("syn5522627_rankings"))
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv", help="parquet needs pyarrow")
+    parser.add_argument("--min-r2", type=float, default=0.80)
+    parser.add_argument("--min-num-clines", type=int, default=4)
+    parser.add_argument("--den-sis", nargs="+", default=den_sis_primary)
+    parser.add_argument("--num-sis", nargs="+", default=num_sis_primary)
+    parser.add_argument("--workers", type=int, default=DEFAULT_READ_WORKERS)
+    parser.add_argument("--no-cache", action="store_true", help="parse the csv files directly")
+    parser.add_argument("--refit", action="store_true", help="refit LL.4 curves to the raw data")
+    args = parser.parse_args(argv)
+
+    timings = {}
+
+    def stage(name, start):
+        timings[name] = time.perf_counter() - start
+        print(f"{name}: {timings[name]:.3f} s")
+        return time.perf_counter()
+
+    start = time.perf_counter()
+    df_files, df_clines, file_name_to_specimen_id = read_metadata(
+        args.data_path, use_cache=not args.no_cache
     )
+    start = stage("metadata", start)
+
+    if args.no_cache:
+        drc_store = build_drc_store(
+            df_files, args.data_path, file_name_to_specimen_id,
+            use_cache=False, max_workers=args.workers,
+        )
+    else:
+        drc_store = load_drc_store(
+            df_files, args.data_path, file_name_to_specimen_id, max_workers=args.workers,
+        )
+    start = stage("ingestion and merge", start)
+
+    if args.refit:
+        drc_store = drc_store.with_params(refit_drc_store(drc_store, max_workers=args.workers))
+        start = stage("refit", start)
+
+    ratio_store = RatioStore(drc_store)
+    df_ratios = ratio_store.ratios(args.num_sis, args.den_sis)
+    df_plt_ratios = filter_ratios_by_r2(df_ratios, args.min_r2)
+    start = stage("ratios", start)
+
+    rankings = {
+        metric: rank_compounds(
+            df_plt_ratios, drc_store.df_compounds, metric,
+            args.den_sis, args.num_sis, args.min_num_clines,
+        )
+        for metric in RANKING_COLUMN_NAMES
+    }
+    start = stage("rankings", start)
+
+    for metric, rankings_by_den in rankings.items():
+        metric_dir = args.out_dir / re.sub(r"[^\w]+", "_", metric).strip("_")
+        metric_dir.mkdir(parents=True, exist_ok=True)
+        for den_si, df_ranked_den in rankings_by_den.items():
+            write_table(df_ranked_den, metric_dir / den_si, args.format)
+    stage("export", start)
+
+    print(f"total: {sum(timings.values()):.3f} s, tables written to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from pathlib import Path
-import numpy as np
+from typing import NamedTuple
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
@@ -8,42 +8,74 @@ import streamlit as st
 from st_aggrid import AgGrid
 from st_aggrid import GridOptionsBuilder
 from services.csv_manager import loadFromFile
+from services import histograms
+from services.ontology import load_ontology
+from services.compound_search import CompoundIndex, n_pages
+from views.exports import download_section
 import sys
 
 sys.path.append('../')
 
 import syn5522627 as syn
 
-def ll4(c, h, inf, zero, ec50):
-    """A copy of the LL.4 function from the R drc package with,
-    https://doseresponse.github.io/drc/reference/LL.4.html
+# LL.4 model from the R drc package, shared with the refitting engine
+ll4 = syn.ll4
 
-     - c: concentration
-     - h: hill slope
-     - inf: asymptote at max concentration
-     - zero: asymptote at zero concentration
-     - ec50: EC50
+
+class Selection(NamedTuple):
+    """The lines and thresholds picked in one session
+
+    Rebuilt from the sidebar widgets (whose state is per session) on every
+    full rerun. It is immutable and hashable, so it is passed to the
+    sections and used in cache keys, while the datasets it applies to are
+    shared read-only by all sessions.
     """
-    num = zero - inf
-    den = 1 + np.exp(h * (np.log(c) - np.log(ec50)))
-    response = inf + num / den
-    return response
+    curve_sis: tuple
+    den_sis: tuple
+    num_sis: tuple
+    min_r2: float
+    min_num_clines: int
+
+
+@st.cache_resource(show_spinner="Loading dose response curves...", max_entries=1)
+def load_dataset(data_path, fingerprint):
+    """One dataset per process, shared read-only by every session
+
+    ``fingerprint`` is only part of the cache key so that the dataset is
+    rebuilt when any source file changes.
+    """
+    return syn.MipeDataset(data_path)
+
+
+def get_dataset(data_path):
+    return load_dataset(str(data_path), syn.get_dataset_fingerprint(data_path))
+
 
+@st.cache_resource(show_spinner="Indexing compounds...", max_entries=1)
+def load_compound_index(_df_compounds, fingerprint):
+    """Search index of the compound table, built once per dataset"""
+    return CompoundIndex(_df_compounds)
 
-def update_df_rank(st=None, df_compounds=None, dfs_drc=None, den_sis=None, num_sis=None):
-    if not den_sis:
-        den_sis = syn.den_sis
-    if not num_sis:
-        num_sis = syn.num_sis
-    st.session_state['df_ratios'] = syn.calculate_fit_ratios(df_compounds, dfs_drc, den_sis, num_sis)
 
+@st.cache_resource(show_spinner="Computing ratios...", max_entries=16)
+def load_ratios(_ratio_store, fingerprint, num_sis, den_sis):
+    """Ratios table of one line selection, shared by all sessions (do not modify in place)"""
+    return _ratio_store.ratios(num_sis, den_sis)
 
-def get_measured_trace(row, label=None, showlegend=False, color=None):
-    cs = row[syn.C_COLS].astype(float).values
-    rs = row[syn.R_COLS].astype(float).values
+
+def get_ratios(dataset, selection):
+    return load_ratios(dataset.ratio_store, dataset.fingerprint, selection.num_sis, selection.den_sis)
+
+
+def get_compound_index(dataset):
+    return load_compound_index(dataset.df_compounds, dataset.fingerprint)
+
+
+def get_measured_trace(curves, ii, label=None, showlegend=False, color=None):
+    """Measured points of the ii-th cell line in ``DrcStore.compound`` output"""
     tr_measured = go.Scatter(
-        x=cs,
-        y=rs,
+        x=curves["conc"][ii],
+        y=curves["resp"][ii],
         mode="markers",
         name=label,
         showlegend=showlegend,
@@ -52,14 +84,14 @@ def get_measured_trace(row, label=None, showlegend=False, color=None):
     return tr_measured
 
 
-def get_fit_trace(row, label=None, showlegend=False, color=None, line_type="dot"):
-    cs = row[syn.C_COLS].astype(float).values
+def get_fit_trace(curves, ii, label=None, showlegend=False, color=None, line_type="dot"):
+    cs = curves["conc"][ii]
     fit_rs = ll4(
         cs,
-        row["HILL"],
-        row["INF"],
-        row["ZERO"],
-        row["AC50"],
+        curves["HILL"][ii],
+        curves["INF"][ii],
+        curves["ZERO"][ii],
+        curves["AC50"][ii],
     )
     tr_fit = go.Scatter(
         x=cs,
@@ -73,12 +105,10 @@ def get_fit_trace(row, label=None, showlegend=False, color=None, line_type="dot"
     return tr_fit
 
 
-def get_ac50_trace(row, label=None, showlegend=False, color=None):
-    rs = row[syn.R_COLS].astype(float).values
+def get_ac50_trace(curves, ii, label=None, showlegend=False, color=None):
     tr_ac50 = go.Scatter(
-        x=[row["AC50"]] * 2,
-        # y=[min(rs), max(rs)],
-        y=[row["ZERO"], row["INF"]],
+        x=[curves["AC50"][ii]] * 2,
+        y=[curves["ZERO"][ii], curves["INF"][ii]],
         mode="lines",
         showlegend=showlegend,
         name=label,
@@ -87,6 +117,27 @@ def get_ac50_trace(row, label=None, showlegend=False, color=None):
     return tr_ac50
 
 
+# maximum number of points sent to the browser per scatter plot
+SCATTER_POINT_BUDGET = 20000
+
+
+def downsample_points(df, max_points, seed=0):
+    """Random (reproducible) sample of at most ``max_points`` rows, keeps row order"""
+    if max_points is None or len(df) <= max_points:
+        return df
+    return df.sample(n=max_points, random_state=seed).sort_index()
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def compute_histogram(_df, key, column, facet_cols=()):
+    """Binned counts of ``_df[column]``, cached per ``key``
+
+    The frame itself is not hashed, ``key`` must identify its contents
+    (dataset fingerprint, R2 threshold and selected lines).
+    """
+    return histograms.binned_histogram(_df, column, facet_cols)
+
+
 def build_grid_options(df):
     # https://towardsdatascience.com/make-dataframes-interactive-in-streamlit-c3d0c4f84ccb
     gb = GridOptionsBuilder.from_dataframe(df)
@@ -104,76 +155,55 @@ def build_grid_options(df):
 # Scores
 # ==================================
 
-def agg_to_list(x):
-    # print(x.to_markdown())
-    # raise
-    return [f"{el:.3f}" for el in list(x)]
-
-def compute_ranked_delta_s_prime(df, df_compounds, df_ratio, st_min_num_clines):
-    df_ranked = (
-        df
-        .groupby(['den_si', 'NCGC SID', 'num_si'])['delta_s_prime']
-        .agg([('Delta S_prime', lambda x: x)])
-        .reset_index()
+@st.cache_data(show_spinner="Bootstrapping delta S' confidence intervals...")
+def compute_delta_s_prime_ci(_ratio_store, fingerprint, num_sis, den_sis, min_r2, n_boot, ci, seed):
+    """Bootstrap CIs of the mean delta S', cached per dataset, selection and settings"""
+    return syn.calculate_delta_s_prime_ci(
+        _ratio_store, num_sis, den_sis, min_r2, n_boot=n_boot, ci=ci, seed=seed,
     )
 
-    df_ranked = df_ranked.loc[df_ranked.den_si.isin(df_ratio.den_sis)]
-    df_ranked = df_ranked.loc[df_ranked.num_si.isin(df_ratio.num_sis)]
 
-    df_ranked = pd.merge(df_compounds, df_ranked, on='NCGC SID')
-    df_ranked = df_ranked.drop(columns='SMILES')
+@st.cache_resource(show_spinner="Ranking compounds...", max_entries=32)
+def load_rankings(_dataset, fingerprint, metric, selection):
+    """Ranked tables of one metric and selection, shared by all sessions (do not modify in place)"""
+    df = syn.filter_ratios_by_r2(get_ratios(_dataset, selection), selection.min_r2)
+    return syn.rank_compounds(
+        df, _dataset.df_compounds, metric, selection.den_sis, selection.num_sis,
+        selection.min_num_clines,
+    )
 
-    # Merge sequence for delta_s_prime
-    for num_si in df_ranked['num_si'].unique():
-        df_ranked_by_num_si = df_ranked.loc[df_ranked.num_si == num_si]
-        df_ranked_by_num_si = df_ranked_by_num_si.rename(columns={
-            'Delta S_prime': num_si,
-        })
 
-        merged_columns = ['NCGC SID', 'name', 'target', 'MoA', 'den_si', 'num_si']
+def compute_rankings(dataset, selection, metric):
+    """Ranked tables of ``metric`` for every selected reference line"""
+    # curve lines do not affect the rankings, keep them out of the cache key
+    selection = selection._replace(curve_sis=())
+    return load_rankings(dataset, dataset.fingerprint, metric, selection)
 
-        df_ranked = pd.merge(df_ranked, df_ranked_by_num_si, how='left',
-                             on=merged_columns)
 
-    df_ranked_delta_s_prime = (
-        df_ranked
-        .groupby(['den_si', 'NCGC SID'])['Delta S_prime']
-        .agg(['size', 'mean', 'var', agg_to_list])
-        .reset_index()
-    )
+def display_rankings(rankings, file_name, key_prefix, cache_key):
+    for count, (den_si, df_ranked_den) in enumerate(rankings.items()):
+        st.subheader("Reference Line: " + den_si)
+        st.write(df_ranked_den)
+        download_section(
+            df_ranked_den, file_name=file_name, key=key_prefix + str(count), cache_key=(cache_key, den_si)
+        )
 
-    df_ranked.drop(columns=['num_si'])
-    merge_columns = ['NCGC SID', 'den_si']
-    df_ranked = pd.merge(df_ranked_delta_s_prime, df_ranked, how='left', on=merge_columns)
 
-    df_ranked = df_ranked.sort_values(
-        ['mean'], ascending=[False],
-    )
-    df_ranked = df_ranked.rename(columns={
-        'size': 'N Cell Lines',
-        'mean': 'mean delta_S_prime',
-        'var': 'variance delta_S_prime',
-        'agg_to_list': 'delta_S_prime values',
-    })
+def compute_ranked_delta_s_prime(dataset, selection, df_ci=None):
+    rankings = compute_rankings(dataset, selection, 'delta_s_prime')
 
-    df_ranked = df_ranked[df_ranked['N Cell Lines'] >= st_min_num_clines]
+    # optional bootstrap confidence intervals of the mean
+    if df_ci is not None:
+        df_ci = df_ci.set_index(['den_si', 'NCGC SID'])
+        rankings = {
+            den_si: df_ranked_den.join(df_ci.loc[den_si])
+            for den_si, df_ranked_den in rankings.items()
+        }
 
-    return df_ranked
+    return rankings
 
-def display_ranked_delta_s_prime_for_download(df_ranked, df_ratio):
-    count = 0
-    for den_si in df_ratio.den_sis:
-        df_ranked_den = df_ranked.loc[df_ranked.den_si == den_si].groupby('NCGC SID').max()
-        st.subheader("Reference Line: " + den_si)
-        st.write(df_ranked_den)
-        st.download_button(
-            label="Download data as CSV",
-            data=df_ranked_den.to_csv().encode('utf-8'),
-            file_name='large_df.csv',
-            mime='text/csv',
-            key='df_s_prime_count_' + str(count)
-        )
-        count = count + 1
+def display_ranked_delta_s_prime_for_download(rankings, cache_key):
+    display_rankings(rankings, file_name='large_df.csv', key_prefix='df_s_prime_count_', cache_key=cache_key)
 
 def eda():
     data_path = Path("data/syn5522627")
@@ -232,67 +262,18 @@ def eda():
 
     COLORS = BREWER_9_SET1
 
-    df_files, df_clines, file_name_to_specimen_id = syn.read_metadata(data_path)
-    file_show_cols = [col for col in df_files.columns if col not in syn.FILE_HIDE_COLS]
-
-    # raw dose-response curve dataframes
-    dfs_drc_raw = syn.read_raw_drc(df_files, data_path)
-
-    # create dose-response curve objects
-    drcs = {}
-    for file_name, df_drc_raw in dfs_drc_raw.items():
-        file_row = df_files.loc[file_name][file_show_cols]
-        drc = syn.DoseResponseCurve(file_row.to_dict(), df_drc_raw)
-        drcs[file_name] = drc
-
-    dfs_drc = syn.make_mrgd_drc(drcs, file_name_to_specimen_id)
-
-    # make one dataframe
-    df_drc = pd.DataFrame()
-    for si, df1 in dfs_drc.items():
-        df1['cell_line'] = si
-        df_drc = pd.concat([df_drc, df1])
-    df_drc['eff'] = df_drc["ZERO"] - df_drc["INF"]
-
-    # all dose response curves have the same compounds so we just take one
-    one_specimen_id = next(iter(dfs_drc.keys()))
-    df_compounds = dfs_drc[one_specimen_id]
-    df_compounds = df_compounds[["NCGC SID", "name", "target", "MoA", "SMILES"]]
-
-    # calculate all ratios
-    df_ratios = syn.calculate_fit_ratios(df_compounds, dfs_drc, syn.den_sis, syn.num_sis)
-    st.session_state['df_ratios'] = df_ratios
+    # cached data preparation, shared by all sessions (do not modify in place)
+    dataset = get_dataset(data_path)
+    df_clines = dataset.df_clines
+    df_drc = dataset.df_drc
 
     # Sidebar
     # ==================================
+    # every widget here is an input of several sections, changing one reruns
+    # the whole page; the sections below are fragments that rerun on their own
 
     with st.sidebar:
 
-        # Compound selector
-        # ----------------------------------
-
-        st.header("Compounds")
-
-        cmp_grid_response = AgGrid(
-            df_compounds,
-            gridOptions=build_grid_options(df_compounds),
-            data_return_mode="AS_INPUT",
-            update_mode="MODEL_CHANGED",
-            #        fit_columns_on_grid_load=True,
-            height=500,
-            #    width='100%',
-        )
-
-        cmp_data = cmp_grid_response["data"]
-        cmp_selected = cmp_grid_response["selected_rows"]
-
-        if cmp_selected:
-            df_compound_selected = pd.DataFrame(cmp_selected)[df_compounds.columns]
-        else:
-            df_compound_selected = df_compounds.iloc[0:1]
-
-        st_ncgc_sid = df_compound_selected.iloc[0]["NCGC SID"]
-
         # Used Cell Lines
         # ----------------------------------
         specimen_ids = df_clines.sort_values("disease")['specimenID']
@@ -315,13 +296,8 @@ def eda():
         # ----------------------------------
         st.header("Thresholds")
 
-        fig = px.histogram(
-            df_drc,
-            x="R2",
-            nbins=50,
-            log_x=False,
-            height=300,
-        )
+        hist = compute_histogram(df_drc, (dataset.fingerprint,), "R2")
+        fig = histograms.histogram_figure(hist, x_title="R2", height=300)
         st.plotly_chart(fig, use_container_width=True)
 
         st_min_r2 = st.slider(
@@ -355,65 +331,120 @@ def eda():
 
         # Used Reference Cell
         # ----------------------------------
-        syn.den_sis_df = pd.DataFrame(syn.den_sis, columns=['syn.den_sis'])
 
         st.header("Cell Lines used as Reference")
         # create a checkbox for each category
-        val = [None] * len(syn.den_sis_df)  # this list will store info about which category is selected
-        i = 0
-        for cat in list(syn.den_sis_primary):
-            # print(cat)
-            # print(syn.den_sis)
-            # print(syn.den_sis_primary)
-            # raise Exception(cat)
-            default_value = True
-            if cat in ['HFF', 'ipn02.8', 'ipn02.3']:
-                default_value = True
-            val[i] = st.sidebar.checkbox(cat, value=default_value, key='syn.den_sis_selector_' + str(i),
-                                         on_change=update_df_rank,
-                                         kwargs={
-                                             'st': st,
-                                             'df_compounds': df_compounds,
-                                             'dfs_drc': dfs_drc,
-                                             'den_sis': syn.den_sis_primary,
-                                             'num_sis': syn.num_sis_primary
-                                         })
-            i = i + 1
-        syn.den_sis = syn.den_sis_df[syn.den_sis_df.isin(syn.den_sis_df[val])].reset_index(
-            drop=True).dropna().values.flatten()
-        syn.den_sis = list(syn.den_sis)
+        den_sis = [
+            cat for i, cat in enumerate(syn.den_sis_primary)
+            if st.sidebar.checkbox(cat, value=True, key='syn.den_sis_selector_' + str(i))
+        ]
 
         # Used Test Cell Lines
         # ----------------------------------
-        syn.num_sis_df = pd.DataFrame(syn.num_sis, columns=['syn.num_sis'])
 
         st.header("Cell Lines used as Test Lines")
         # create a checkbox for each category
-        val = [None] * len(syn.num_sis_df)  # this list will store info about which category is selected
-        for i, cat in enumerate(syn.num_sis):
-            default_value = True
-            if cat in ['ipNF05.5']:
-                default_value = False
-            val[i] = st.sidebar.checkbox(cat, value=default_value, key='syn.num_sis_selector_' + str(i),
-                                         on_change=update_df_rank,
-                                         kwargs={
-                                             'st': st,
-                                             'df_compounds': df_compounds,
-                                             'dfs_drc': dfs_drc,
-                                             'den_sis': syn.den_sis,
-                                             'num_sis': syn.num_sis
-                                         })
-
-        syn.num_sis = syn.num_sis_df[syn.num_sis_df.isin(syn.num_sis_df[val])].reset_index(
-            drop=True).dropna().values.flatten()
-        syn.num_sis = list(syn.num_sis)
-
-    # Compounds
+        num_sis = [
+            cat for i, cat in enumerate(syn.num_sis_primary)
+            if st.sidebar.checkbox(cat, value=cat not in ['ipNF05.5'], key='syn.num_sis_selector_' + str(i))
+        ]
+
+    selection = Selection(
+        curve_sis=tuple(specimen_ids),
+        den_sis=tuple(den_sis),
+        num_sis=tuple(num_sis),
+        min_r2=st_min_r2,
+        min_num_clines=st_min_num_clines,
+    )
+
+    # Sections
     # ==================================
+    # declared inputs are the arguments, a fragment rerun reuses the values
+    # of the last full run
+
+    compound_section(dataset, selection, COLORS)
+
+    cell_line_section(dataset, selection)
+
+    distributions_section(dataset, selection)
+
+    analyses_section(dataset, selection)
+
+
+# partial reruns: st.fragment (streamlit >= 1.37), st.experimental_fragment
+# (1.33 - 1.36), plain full reruns on older versions
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
+
+@fragment
+def compound_section(dataset, selection, COLORS):
+    """Compound picker and the dose response curves of the picked compound
+
+    Picking a compound only reruns this section.
+    """
+    df_compounds = dataset.df_compounds
+    drc_store = dataset.drc_store
+    specimen_ids = list(selection.curve_sis)
+    den_sis = selection.den_sis
+    st_min_r2 = selection.min_r2
+
+    # Compound selector
+    # ----------------------------------
+    # searched server side, only one page of results goes to the browser
+
+    st.header("Compounds")
+
+    compound_index = get_compound_index(dataset)
+
+    col1, col2, col3 = st.columns([3, 1, 1])
+    with col1:
+        st_query = st.text_input("Search name, target, MoA or NCGC SID", key="compound_query")
+    rows = compound_index.search(st_query)
+    with col2:
+        st_page = st.number_input(
+            "Page", min_value=1, max_value=n_pages(len(rows)), value=1, step=1,
+            key="compound_page",
+        )
+    with col3:
+        st_show_smiles = st.checkbox("Show SMILES", value=False, key="compound_smiles")
+    st.caption(f"{len(rows)} of {len(compound_index)} compounds")
+
+    df_compounds_page = compound_index.page(rows, int(st_page) - 1, with_smiles=st_show_smiles)
+
+    cmp_grid_response = AgGrid(
+        df_compounds_page,
+        gridOptions=build_grid_options(df_compounds_page),
+        data_return_mode="AS_INPUT",
+        update_mode="MODEL_CHANGED",
+        #        fit_columns_on_grid_load=True,
+        height=400,
+        #    width='100%',
+        # a new grid per page, the selection is kept in the session state
+        key=f"compound_grid_{st_query}_{st_page}_{st_show_smiles}",
+    )
+
+    cmp_selected = cmp_grid_response["selected_rows"]
+
+    if cmp_selected:
+        st.session_state["compound_sid"] = cmp_selected[0]["NCGC SID"]
+    st_ncgc_sid = st.session_state.get("compound_sid", df_compounds.iloc[0]["NCGC SID"])
+
+    df_compound_selected = compound_index.page(
+        [drc_store.sid_index[st_ncgc_sid]], with_smiles=st_show_smiles,
+    ).reset_index(drop=True)
 
     st.header("Selected Compound")
     st.dataframe(df_compound_selected)
 
+    # fit parameters and measured points of the selected compound in every selected line
+    curves = drc_store.compound(st_ncgc_sid, specimen_ids)
+    df_sctr_compound = pd.DataFrame({
+        "cell line": specimen_ids,
+        "ac50": curves["AC50"],
+        "eff": curves["eff"],
+        "R2": curves["R2"],
+    })
+
     col1, col2 = st.columns([2, 2])
 
     # Dose Response Curves
@@ -423,15 +454,7 @@ def eda():
 
         st.subheader("Dose Response Curves")
 
-        num_cell_lines = len(specimen_ids)
-
-        r2s = {}
-        for specimen_id in specimen_ids:
-            df = dfs_drc[specimen_id]
-            row = df[df["NCGC SID"] == st_ncgc_sid].iloc[0]
-            r2s[specimen_id] = row["R2"]
-
-        titles = [f"{si}<br>R2={r2s[si]:.2f}" for si in specimen_ids]
+        titles = [f"{si}<br>R2={r2:.2f}" for si, r2 in zip(specimen_ids, curves["R2"])]
 
         n_cols = 3
         n_rows = 3
@@ -449,27 +472,12 @@ def eda():
         i_col = 1
         i_tot = 0
 
-        df_sctr = {
-            "cell line": [],
-            "ac50": [],
-            "eff": [],
-            "R2": [],
-        }
-
-        for specimen_id in specimen_ids:
-
-            df = dfs_drc[specimen_id]
-
-            row = df[df["NCGC SID"] == st_ncgc_sid].iloc[0]
-            df_sctr["cell line"].append(specimen_id)
-            df_sctr["ac50"].append(row["AC50"])
-            df_sctr["eff"].append(row["ZERO"] - row["INF"])
-            df_sctr["R2"].append(row["R2"])
+        for ii, specimen_id in enumerate(specimen_ids):
 
             i_color = i_tot
-            tr_measured = get_measured_trace(row, color=COLORS[i_color])
-            tr_fit = get_fit_trace(row, color=COLORS[i_color])
-            tr_ac50 = get_ac50_trace(row, color=COLORS[i_color])
+            tr_measured = get_measured_trace(curves, ii, color=COLORS[i_color])
+            tr_fit = get_fit_trace(curves, ii, color=COLORS[i_color])
+            tr_ac50 = get_ac50_trace(curves, ii, color=COLORS[i_color])
             for tr in [tr_measured, tr_fit, tr_ac50]:
                 fig.add_trace(tr, row=i_row, col=i_col)
 
@@ -496,7 +504,7 @@ def eda():
     with col2:
 
         st.subheader("Effectiveness vs AC50")
-        df_sctr = pd.DataFrame(df_sctr)
+        df_sctr = df_sctr_compound.copy()
         df_sctr["color"] = COLORS[: df_sctr.shape[0]]
         df_sctr = df_sctr[df_sctr["R2"] >= st_min_r2].reset_index()
         fig = px.scatter(
@@ -529,8 +537,6 @@ def eda():
     st.subheader("Combined Response Curves")
     use_full_colors = st.radio("Display lines in full color?", ('No', 'Yes'))
 
-    num_cell_lines = len(specimen_ids)
-
     titles = [df_compound_selected['name'][0] + "<br>" + df_compound_selected['NCGC SID'][0]]
 
     EXTENDED_COLORS = COLORS
@@ -538,12 +544,6 @@ def eda():
     i_col = 1
     i_tot = 0
 
-    r2s = {}
-    for specimen_id in specimen_ids:
-        df = dfs_drc[specimen_id]
-        row = df[df["NCGC SID"] == st_ncgc_sid].iloc[0]
-        r2s[specimen_id] = row["R2"]
-
     n_cols = 1
     n_rows = 1
     fig = make_subplots(
@@ -556,37 +556,21 @@ def eda():
         subplot_titles=titles,
     )
 
-    df_sctr = {
-        "cell line": [],
-        "ac50": [],
-        "eff": [],
-        "R2": [],
-    }
-
-    for specimen_id in specimen_ids:
-
-        df = dfs_drc[specimen_id]
-
-        row = df[df["NCGC SID"] == st_ncgc_sid].iloc[0]
-        df_sctr["cell line"].append(specimen_id)
-        df_sctr["ac50"].append(row["AC50"])
-        df_sctr["eff"].append(row["ZERO"] - row["INF"])
-        df_sctr["R2"].append(row["R2"])
+    for ii, specimen_id in enumerate(specimen_ids):
 
         if use_full_colors == "Yes":
             i_color = i_tot
             ac50_color = i_tot
         else:
-            if specimen_id in syn.den_sis:
+            if specimen_id in den_sis:
                 i_color = 8
                 ac50_color = 7
             else:
                 i_color = 0
                 ac50_color = 1
-        tr_measured = get_measured_trace(row, color=COLORS[i_color])
-        tr_fit = get_fit_trace(row, label=specimen_id, color=EXTENDED_COLORS[i_color], showlegend=True,
+        tr_fit = get_fit_trace(curves, ii, label=specimen_id, color=EXTENDED_COLORS[i_color], showlegend=True,
                                line_type="solid")
-        tr_ac50 = get_ac50_trace(row, color=EXTENDED_COLORS[ac50_color])
+        tr_ac50 = get_ac50_trace(curves, ii, color=EXTENDED_COLORS[ac50_color])
         for tr in [tr_fit, tr_ac50]:
             fig.add_trace(tr, row=1, col=1)
 
@@ -608,6 +592,17 @@ def eda():
     fig.update_layout(hovermode='x unified')
     st.plotly_chart(fig, use_container_width=True)
 
+
+@fragment
+def cell_line_section(dataset, selection):
+    """Cell line picker and the AC50 / eff scatter plots
+
+    Picking a cell line only reruns this section.
+    """
+    df_clines = dataset.df_clines
+    drc_store = dataset.drc_store
+    st_min_r2 = selection.min_r2
+
     # Cell Lines
     # ==================================
 
@@ -623,6 +618,7 @@ def eda():
         update_mode="MODEL_CHANGED",
         # fit_columns_on_grid_load=True,
         width="100%",
+        key="cell_line_grid",
     )
 
     cl_data = cl_grid_response["data"]
@@ -640,30 +636,8 @@ def eda():
     st.header("Selected Cell Line")
     st.dataframe(df_clines_selected)
 
-    df_sctr = {
-        "NCGC SID": [],
-        "compound": [],
-        "AC50": [],
-        "eff": [],
-        "target": [],
-        "R2": [],
-    }
-
-    df = dfs_drc[st_specimen_id]
-    for indx, row in df.iterrows():
-
-        if row["R2"] < st_min_r2:
-            continue
-
-        df_sctr["NCGC SID"].append(row["NCGC SID"])
-        df_sctr["compound"].append(row["name"])
-        df_sctr["AC50"].append(row["AC50"])
-        df_sctr["eff"].append(row["ZERO"] - row["INF"])
-        df_sctr["target"].append(row["target"])
-        df_sctr["R2"].append(row["R2"])
-
-    df_sctr = pd.DataFrame(df_sctr)
-    df_sctr = pd.merge(df_sctr, df_compounds[["NCGC SID", "MoA"]], on="NCGC SID")
+    df_sctr = drc_store.scatter_frame([st_specimen_id], st_min_r2)
+    df_sctr = downsample_points(df_sctr, SCATTER_POINT_BUDGET)
     fig = px.scatter(
         df_sctr,
         x="AC50",
@@ -672,6 +646,7 @@ def eda():
         color="R2",
         range_color=(0.5, 1),
         height=600,
+        render_mode="webgl",
     )
     fig.update_xaxes(type="log")
     fig.update_yaxes(range=[-100, 250])
@@ -684,33 +659,11 @@ def eda():
     # ---------------------------------
     st.header("All Cell Lines")
 
-    df_sctr = {
-        "NCGC SID": [],
-        "compound": [],
-        "AC50": [],
-        "eff": [],
-        "target": [],
-        "cell line": [],
-        "R2": [],
-    }
-
-    for specimen_id, df in dfs_drc.items():
-
-        for indx, row in df.iterrows():
-
-            if row["R2"] < st_min_r2:
-                continue
-
-            df_sctr["NCGC SID"].append(row["NCGC SID"])
-            df_sctr["compound"].append(row["name"])
-            df_sctr["AC50"].append(row["AC50"])
-            df_sctr["eff"].append(row["ZERO"] - row["INF"])
-            df_sctr["target"].append(row["target"])
-            df_sctr["cell line"].append(specimen_id)
-            df_sctr["R2"].append(row["R2"])
-
-    df_sctr = pd.DataFrame(df_sctr)
-    df_sctr = pd.merge(df_sctr, df_compounds[["NCGC SID", "MoA"]], on="NCGC SID")
+    df_sctr = drc_store.scatter_frame(drc_store.cell_lines, st_min_r2)
+    n_points = len(df_sctr)
+    df_sctr = downsample_points(df_sctr, SCATTER_POINT_BUDGET)
+    if len(df_sctr) < n_points:
+        st.caption(f"Showing a random sample of {len(df_sctr)} of {n_points} points.")
     fig = px.scatter(
         df_sctr,
         x="AC50",
@@ -718,6 +671,7 @@ def eda():
         hover_data=["compound", "target", "MoA"],
         height=600,
         color="cell line",
+        render_mode="webgl",
         #    color_discrete_sequence=COLORS,
     )
     fig.update_xaxes(type="log")
@@ -727,10 +681,17 @@ def eda():
         use_container_width=True,
     )
 
+
+def distributions_section(dataset, selection):
+    """Histograms of the fit parameters and ratios, binned server side and cached"""
+    df_drc = dataset.df_drc
+    st_min_r2 = selection.min_r2
+
     # Distributions
     # ==================================
 
     df_plt_drc = df_drc[df_drc["R2"] >= st_min_r2]
+    drc_key = (dataset.fingerprint, st_min_r2)
 
     # AC50
     # ----------------------------------
@@ -740,25 +701,13 @@ def eda():
     col1, col2 = st.columns(2)
 
     with col1:
-        fig = px.histogram(
-            df_plt_drc,
-            x="LAC50",
-            nbins=50,
-            log_x=False,
-            height=600,
-        )
+        hist = compute_histogram(df_plt_drc, drc_key, "LAC50")
+        fig = histograms.histogram_figure(hist, x_title="LAC50", height=600)
         st.plotly_chart(fig, use_container_width=True)
 
     with col2:
-        fig = px.histogram(
-            df_plt_drc,
-            x="LAC50",
-            nbins=50,
-            log_x=False,
-            facet_col='cell_line',
-            facet_col_wrap=3,
-            height=600,
-        )
+        hist = compute_histogram(df_plt_drc, drc_key, "LAC50", ("cell_line",))
+        fig = histograms.facet_col_wrap_figure(hist, facet_col_wrap=3, height=600)
         st.plotly_chart(fig, use_container_width=True)
 
     # eff
@@ -769,48 +718,27 @@ def eda():
     col1, col2 = st.columns(2)
 
     with col1:
-        fig = px.histogram(
-            df_plt_drc,
-            x="eff",
-            nbins=50,
-            log_x=False,
-            height=600,
-        )
+        hist = compute_histogram(df_plt_drc, drc_key, "eff")
+        fig = histograms.histogram_figure(hist, x_title="eff", height=600)
         st.plotly_chart(fig, use_container_width=True)
 
     with col2:
-        fig = px.histogram(
-            df_plt_drc,
-            x="eff",
-            nbins=50,
-            log_x=False,
-            facet_col='cell_line',
-            facet_col_wrap=3,
-            height=600,
-        )
+        hist = compute_histogram(df_plt_drc, drc_key, "eff", ("cell_line",))
+        fig = histograms.facet_col_wrap_figure(hist, facet_col_wrap=3, height=600)
         st.plotly_chart(fig, use_container_width=True)
 
     # AC50 ratios
     # ----------------------------------
 
-    df_ratios = st.session_state['df_ratios']
-
-    df_plt_ratios = df_ratios[
-        (df_ratios['num_R2'] >= st_min_r2)
-        & (df_ratios['den_R2'] >= st_min_r2)
-        ]
+    df_plt_ratios = syn.filter_ratios_by_r2(get_ratios(dataset, selection), st_min_r2)
+    ratios_key = (dataset.fingerprint, st_min_r2, selection.den_sis, selection.num_sis)
 
     st.header("Log10 (AC50_num / AC50_den) Distribution")
 
-    fig = px.histogram(
-        df_plt_ratios,
-        x="Log10 (AC50 ratio)",
-        nbins=50,
-        facet_row='den_si',
-        facet_col='num_si',
-        log_x=False,
-        height=800,
+    hist = compute_histogram(
+        df_plt_ratios, ratios_key, "Log10 (AC50 ratio)", ("den_si", "num_si")
     )
+    fig = histograms.facet_grid_figure(hist, height=800)
 
     st.plotly_chart(fig, use_container_width=True)
 
@@ -819,15 +747,10 @@ def eda():
 
     st.header("(eff_num / eff_den) Distribution")
 
-    fig = px.histogram(
-        df_plt_ratios,
-        x="eff ratio",
-        nbins=50,
-        facet_row='den_si',
-        facet_col='num_si',
-        log_x=False,
-        height=800,
+    hist = compute_histogram(
+        df_plt_ratios, ratios_key, "eff ratio", ("den_si", "num_si")
     )
+    fig = histograms.facet_grid_figure(hist, height=800)
 
     st.plotly_chart(fig, use_container_width=True)
 
@@ -836,194 +759,96 @@ def eda():
 
     st.header("eff ratio / AC50 ratio Distribution")
 
-    fig = px.histogram(
-        df_plt_ratios[df_plt_ratios['score'] > 0],
-        x="Log10 score",
-        nbins=50,
-        facet_row='den_si',
-        facet_col='num_si',
-        log_x=False,
-        height=800,
+    hist = compute_histogram(
+        df_plt_ratios[df_plt_ratios['score'] > 0], ratios_key, "Log10 score", ("den_si", "num_si")
     )
+    fig = histograms.facet_grid_figure(hist, height=800)
 
     st.plotly_chart(fig, use_container_width=True)
 
-    # Scores
-    # ==================================
-
-    st.header("Compounds ranked by AC50 ratios")
-
-    df_rank_ratios = df_plt_ratios
-    # df_rank_ratios = df_plt_ratios[
-    #     (df_plt_ratios["Log10 (AC50 ratio)"] >= st_min_lac50_ratio)
-    #     & (df_plt_ratios["Log10 (AC50 ratio)"] <= st_max_lac50_ratio)
-    #     ]
-
-    df_ranked = (
-        df_rank_ratios
-        .groupby(['den_si', 'NCGC SID', 'num_si'])['Log10 (AC50 ratio)']
-        .agg([('Log10 (AC50 ratio)', lambda x: x)])
-        .reset_index()
-    )
-
-    df_ranked = df_ranked.loc[df_ranked.den_si.isin(syn.den_sis)]
-    df_ranked = df_ranked.loc[df_ranked.num_si.isin(syn.num_sis)]
-
-    df_ranked = pd.merge(df_compounds, df_ranked, on='NCGC SID')
-    df_ranked = df_ranked.drop(columns='SMILES')
-    df_ranked_original = df_ranked.copy()
 
-    for num_si in syn.num_sis:
-        df_ranked_by_num_si = df_ranked_original.loc[df_ranked_original.num_si == num_si]
+# heavy analyses, only the opened one is computed
+ANALYSES = [
+    "Ranked by AC50 ratios",
+    "Ranked by delta S",
+    "Ranked by delta S prime",
+    "Gene target ontology",
+]
 
-        df_ranked_by_num_si = df_ranked_by_num_si.rename(columns={
-            'Log10 (AC50 ratio)': num_si,
-        })
 
-        merged_columns = ['NCGC SID', 'name', 'target', 'MoA', 'den_si', 'num_si']
+@fragment
+def analyses_section(dataset, selection):
+    """Rankings and the ontology merge behind lazy tabs
 
-        df_ranked = pd.merge(df_ranked, df_ranked_by_num_si, how='left',
-                             on=merged_columns)
+    Nothing is computed until a tab is opened, and switching tabs or
+    changing the bootstrap settings only reruns this section.
+    """
+    ratio_store = dataset.ratio_store
 
-    df_ranked_final = (
-        df_ranked
-        .groupby(['den_si', 'NCGC SID'])['Log10 (AC50 ratio)']
-        .agg(['size', 'mean', 'var', agg_to_list])
-        .reset_index()
+    st_analysis = st.radio(
+        "Analyses", ANALYSES, index=None, horizontal=True, key="analysis_tab",
     )
 
-    df_ranked.drop(columns=['num_si'])
-    merge_columns = ['NCGC SID', 'den_si']
-    df_ranked = pd.merge(df_ranked_final, df_ranked, how='left', on=merge_columns)
+    if st_analysis == "Ranked by AC50 ratios":
 
-    df_ranked = df_ranked.sort_values(
-        ['mean'], ascending=[False],
-    )
-    df_ranked = df_ranked.rename(columns={
-        'size': 'N Cell Lines',
-        'mean': 'mean Log10 AC50 ratios',
-        'var': 'variance Log10 AC50 ratios',
-        'agg_to_list': 'Log10 AC50 ratios',
-    })
+        st.header("Compounds ranked by AC50 ratios")
 
-    df_ranked = df_ranked[df_ranked['N Cell Lines'] >= st_min_num_clines]
-
-    count = 0
-    for den_si in syn.den_sis:
-        df_ranked_den = df_ranked.loc[df_ranked.den_si == den_si].groupby('NCGC SID').max()
-        st.subheader("Reference Line: " + den_si)
-        st.write(df_ranked_den)
-        st.download_button(
-            label="Download data as CSV",
-            data=df_ranked_den.to_csv().encode('utf-8'),
-            file_name='log_ac50_ratio_mean.csv',
-            mime='text/csv',
-            key='den_sis_count'+str(count)
+        rankings = compute_rankings(dataset, selection, 'Log10 (AC50 ratio)')
+        display_rankings(
+            rankings, file_name='log_ac50_ratio_mean.csv', key_prefix='den_sis_count',
+            cache_key=(dataset.fingerprint, selection, 'Log10 (AC50 ratio)'),
         )
-        count = count + 1
-
-    st.header("Compounds ranked by delta S")
 
-    df_rank_ratios = df_plt_ratios
-    # df_rank_ratios = df_plt_ratios[
-    #     (df_plt_ratios["Log10 (AC50 ratio)"] > st_min_lac50_ratio)
-    #     & (df_plt_ratios["Log10 (AC50 ratio)"] < st_max_lac50_ratio)
-    #     ]
-
-    df_ranked = (
-        df_rank_ratios
-        .groupby(['den_si', 'NCGC SID', 'num_si'])['Log10 score']
-        .agg([('Log10 score', lambda x: x)])
-        .reset_index()
-    )
+    elif st_analysis == "Ranked by delta S":
 
-    df_ranked = df_ranked.loc[df_ranked.den_si.isin(syn.den_sis)]
-    df_ranked = df_ranked.loc[df_ranked.num_si.isin(syn.num_sis)]
+        st.header("Compounds ranked by delta S")
 
-    df_ranked = pd.merge(df_compounds, df_ranked, on='NCGC SID')
-    df_ranked = df_ranked.drop(columns='SMILES')
-    df_ranked_original = df_ranked.copy()
-
-    for num_si in syn.num_sis:
-        # Merge sequence for delta_S
-        df_ranked_by_num_si = df_ranked_original.loc[df_ranked_original.num_si == num_si]
-        df_ranked_by_num_si = df_ranked_by_num_si.rename(columns={
-            'Log10 score': num_si,
-        })
-
-        merged_columns = ['NCGC SID', 'name', 'target', 'MoA', 'den_si', 'num_si']
-
-        df_ranked = pd.merge(df_ranked, df_ranked_by_num_si, how='left',
-                             on=merged_columns)
-
-    df_ranked_delta_s = (
-        df_ranked
-        .groupby(['den_si', 'NCGC SID'])['Log10 score']
-        .agg(['size', 'mean', 'var', agg_to_list])
-        .reset_index()
-    )
-    df_ranked.drop(columns=['num_si'])
-    merge_columns = ['NCGC SID', 'den_si']
-    df_ranked = pd.merge(df_ranked_delta_s, df_ranked, how='left', on=merge_columns)
-
-
-    df_ranked = df_ranked.sort_values(
-        ['mean'], ascending=[False],
-    )
-    df_ranked = df_ranked.rename(columns={
-        'size': 'N Cell Lines',
-        'mean': 'mean delta_S',
-        'var': 'variance delta_S',
-        'agg_to_list': 'delta_S Scores (Log10)',
-    })
-
-    df_ranked = df_ranked[df_ranked['N Cell Lines'] >= st_min_num_clines]
+        rankings = compute_rankings(dataset, selection, 'Log10 score')
+        display_rankings(
+            rankings, file_name='large_df.csv', key_prefix='df_count_',
+            cache_key=(dataset.fingerprint, selection, 'Log10 score'),
+        )
 
-    count = 0
-    for den_si in syn.den_sis:
-        df_ranked_den = df_ranked.loc[df_ranked.den_si == den_si].groupby('NCGC SID').max()
-        st.subheader("Reference Line: " + den_si)
-        st.write(df_ranked_den)
-        st.download_button(
-            label="Download data as CSV",
-            data=df_ranked_den.to_csv().encode('utf-8'),
-            file_name='large_df.csv',
-            mime='text/csv',
-            key='df_count_' + str(count)
+    elif st_analysis == "Ranked by delta S prime":
+
+        # Start of S Prime Diplay
+        st.header("Compounds ranked by delta S prime")
+
+        st_bootstrap = st.checkbox("Add bootstrap confidence intervals of the mean delta S prime", value=False)
+        df_ci = None
+        ci_settings = None
+        if st_bootstrap:
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st_n_boot = st.number_input("Resamples", min_value=100, max_value=20000, value=1000, step=100)
+            with col2:
+                st_ci = st.slider("Confidence level", min_value=0.5, max_value=0.99, value=0.95, step=0.01)
+            with col3:
+                st_seed = st.number_input("Random seed", min_value=0, value=0, step=1)
+            ci_settings = (int(st_n_boot), st_ci, int(st_seed))
+            df_ci = compute_delta_s_prime_ci(
+                ratio_store, dataset.fingerprint, selection.num_sis, selection.den_sis, selection.min_r2,
+                *ci_settings,
+            )
+
+        rankings = compute_ranked_delta_s_prime(dataset, selection, df_ci=df_ci)
+        display_ranked_delta_s_prime_for_download(
+            rankings, cache_key=(dataset.fingerprint, selection, 'delta_s_prime', ci_settings)
         )
-        count = count + 1
 
-    # Start of S Prime Diplay
-    st.header("Compounds ranked by delta S prime")
-    # Reset the context of df_rank_ratios
-    df_rank_ratios = df_plt_ratios
-   
-    df_ranked = compute_ranked_delta_s_prime(df_rank_ratios, df_compounds, syn, st_min_num_clines)
-    display_ranked_delta_s_prime_for_download(df_ranked, df_ratio=syn)
+    elif st_analysis == "Gene target ontology":
 
-  # Gene Targets with a Manually Grouped Ontology
-    # ----------------------------------
+        # Gene Targets with a Manually Grouped Ontology
+        # ----------------------------------
 
-    st.header("Gene Targets with a Manually Grouped Ontology")
-    df_ratios = st.session_state['df_ratios']
-    df_targets = df_ratios.loc[:,"target"]
-    df_targets.unique()
-    # Manually curated ontology by gene target 
-    target = pd.read_csv('Manual_ontology.csv')
-    df_reference_ontolgy = pd.DataFrame ( columns = ["Group", "Sub", "Gene"])
-    Group = None
-    for i in range(len(target)):
-        Current_group = str(target.loc[i,'Group']).strip()
-        if Current_group != "nan": 
-            Group = Current_group 
-        df_reference_ontolgy.loc[i] = [Group, target.loc[i,'Sub'], target.loc[i,'Gene']]
-    df_merging = df_ratios .merge (df_reference_ontolgy, left_on ='target', right_on = 'Gene' )
-    st.write(df_merging)
-    st.download_button(
-        label="Download data as CSV",
-        data=df_merging.to_csv().encode('utf-8'),
-        file_name='large_df.csv',
-        mime='text/csv',
-        key='df_merge'
-    )
+        st.header("Gene Targets with a Manually Grouped Ontology")
+        # compound columns are only joined here, for display
+        df_ratios = syn.join_compound_meta(get_ratios(dataset, selection), dataset.df_compounds)
+        # Manually curated ontology by gene target
+        df_reference_ontolgy = load_ontology().frame
+        df_merging = df_ratios .merge (df_reference_ontolgy, left_on ='target', right_on = 'Gene' )
+        st.write(df_merging)
+        download_section(
+            df_merging, file_name='large_df.csv', key='df_merge', cache_key=(dataset.fingerprint, selection)
+        )
 
@@ -0,0 +1,56 @@
+import streamlit as st
+
+from services.exports import EXPORT_FORMATS, export_bytes, export_file_name, frame_fingerprint
+
+
+@st.cache_data(show_spinner="Preparing download...", max_entries=32)
+def cached_export_bytes(_df, fingerprint, file_format):
+    """Serialized table, cached per content ``fingerprint`` and format"""
+    return export_bytes(_df, file_format)
+
+
+def download_section(df, file_name, key, cache_key, label="Download data"):
+    """Format picker, 'Prepare download' button and the download button
+
+    Nothing is hashed or serialized until the table is prepared. ``cache_key``
+    is a cheap hashable identifying the contents of ``df`` (e.g. the dataset
+    fingerprint and the selection it was computed from). The content
+    fingerprint is taken once on 'Prepare download' and kept with it, and the
+    prepared state is dropped as soon as ``cache_key`` changes, so a changed
+    table needs a new click.
+    """
+    prepared_key = key + "_prepared"
+
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        file_format = st.selectbox(
+            "Format",
+            list(EXPORT_FORMATS),
+            format_func=lambda fmt: EXPORT_FORMATS[fmt][0],
+            key=key + "_format",
+            label_visibility="collapsed",
+        )
+    with col2:
+        if st.button("Prepare download", key=key + "_prepare"):
+            st.session_state[prepared_key] = (cache_key, frame_fingerprint(df))
+
+    prepared = st.session_state.get(prepared_key)
+    if prepared is None:
+        return
+    prepared_cache_key, fingerprint = prepared
+    if prepared_cache_key != cache_key:
+        del st.session_state[prepared_key]
+        return
+
+    try:
+        data = cached_export_bytes(df, fingerprint, file_format)
+    except ImportError as err:
+        st.error(f"{EXPORT_FORMATS[file_format][0]} export is not available: {err}")
+        return
+    st.download_button(
+        label=label,
+        data=data,
+        file_name=export_file_name(file_name, file_format),
+        mime=EXPORT_FORMATS[file_format][2],
+        key=key,
+    )
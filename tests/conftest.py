@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the app modules import each other from the app directory (as streamlit runs them)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
@@ -0,0 +1,37 @@
+import numpy as np
+
+import syn5522627 as syn
+
+
+def synthetic_curves(n_curves, noise_sd, seed=0):
+    rng = np.random.default_rng(seed)
+    conc = np.tile(np.logspace(-9, -4, 11), (n_curves, 1))
+    hill = rng.uniform(0.5, 3, n_curves)
+    inf = rng.uniform(-40, -5, n_curves)
+    zero = rng.uniform(-10, 10, n_curves)
+    ec50 = 10 ** rng.uniform(-8, -5, n_curves)
+    resp = syn.ll4(conc, hill[:, None], inf[:, None], zero[:, None], ec50[:, None])
+    resp = resp + rng.normal(0, noise_sd, resp.shape)
+    return conc, resp, hill, inf, zero, ec50
+
+
+def test_fit_ll4_recovers_noiseless_curves():
+    conc, resp, hill, inf, zero, ec50 = synthetic_curves(200, noise_sd=0)
+    fit = syn.fit_ll4(conc, resp)
+
+    np.testing.assert_allclose(fit["R2"], 1, atol=1e-6)
+    np.testing.assert_allclose(fit["ZERO"] - fit["INF"], zero - inf, atol=1e-3)
+
+
+def test_fit_ll4_keeps_hill_positive():
+    # (h, inf, zero) and (-h, zero, inf) are the same curve, the fit must
+    # report the one with INF at max concentration so eff keeps its sign
+    conc, resp, hill, inf, zero, ec50 = synthetic_curves(1000, noise_sd=5)
+    fit = syn.fit_ll4(conc, resp)
+
+    assert (fit["HILL"] >= 0).all()
+
+    eff = fit["ZERO"] - fit["INF"]
+    fitted = fit["R2"] > 0.8
+    assert fitted.sum() > 500
+    assert (np.sign(eff[fitted]) == np.sign(zero - inf)[fitted]).all()
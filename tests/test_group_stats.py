@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from services.group_stats import grouped_mannwhitneyu, mwu_exact_sf
+
+
+def test_mwu_exact_sf_matches_scipy():
+    rng = np.random.default_rng(0)
+    for m, n in [(1, 1), (3, 5), (4, 30), (8, 9)]:
+        x, y = rng.normal(size=m), rng.normal(size=n)
+        u1 = stats.mannwhitneyu(x, y).statistic
+        u = max(u1, m * n - u1)
+        expected = stats.mannwhitneyu(x, y, method="exact").pvalue
+        assert np.isclose(min(2 * mwu_exact_sf(m, n)[int(u)], 1), expected)
+
+
+def test_grouped_mannwhitneyu_matches_scipy():
+    rng = np.random.default_rng(0)
+    rows = []
+    for ii in range(200):
+        n_ref, n_test = rng.integers(1, 40), rng.integers(1, 12)
+        values = rng.normal(size=n_ref + n_test)
+        if ii % 3 == 0:
+            values = np.round(values, 1)  # ties, normal approximation
+        rows += [(f"c{ii}", value, jj < n_ref) for jj, value in enumerate(values)]
+    df = pd.DataFrame(rows, columns=["name", "value", "is_ref"])
+
+    result = grouped_mannwhitneyu(df["name"], df["value"], df["is_ref"])
+
+    for name, df_name in df.groupby("name"):
+        expected = stats.mannwhitneyu(
+            df_name.loc[df_name["is_ref"], "value"], df_name.loc[~df_name["is_ref"], "value"]
+        )
+        assert np.isclose(result.at[name, "u_stat"], expected.statistic)
+        assert np.isclose(result.at[name, "p_value"], expected.pvalue, rtol=1e-9)